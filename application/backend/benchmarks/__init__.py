@@ -0,0 +1 @@
+# application/benchmarks/__init__.py
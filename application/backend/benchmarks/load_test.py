@@ -0,0 +1,93 @@
+# application/benchmarks/load_test.py
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+# Load test for the /ask endpoint.
+# Sends the same set of questions to a running backend at increasing concurrency levels and reports
+# throughput and latency percentiles for each level, so we can check that throughput scales with
+# concurrency instead of flattening out at one request at a time.
+#
+# Usage (from application/backend):
+#   python -m benchmarks.load_test --url http://localhost:8000 --concurrency 1 2 4 8 16 32 --requests 64
+
+DEFAULT_QUESTIONS = [
+    "How can I deal with anxiety before exams?",
+    "What are the signs of depression?",
+    "How do I support a friend who is grieving?",
+    "Why can't I sleep at night?",
+    "How can I stop overthinking everything?",
+    "Is it normal to feel lonely in a relationship?",
+    "How do I know if I need therapy?",
+    "What can I do about panic attacks?",
+]
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+async def run_level(client, url, questions, concurrency, total_requests):
+    """Send total_requests questions with at most `concurrency` in flight and collect timings."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/ask", json={"question": questions[i % len(questions)]})
+                if response.status_code != 200:
+                    errors += 1
+                    return
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+async def main(args):
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'mean (s)':>8}")
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.url.rstrip("/"), DEFAULT_QUESTIONS, concurrency, args.requests)
+            print(
+                f"{result['concurrency']:>11} {result['requests']:>8} {result['errors']:>6} "
+                f"{result['throughput']:>8.2f} {result['p50']:>8.2f} {result['p95']:>8.2f} {result['mean']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the /ask endpoint at increasing concurrency levels.")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running backend")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Concurrency levels to test")
+    parser.add_argument("--requests", type=int, default=64, help="Requests sent at each concurrency level")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request client timeout in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,240 @@
+# application/benchmarks/offline_suite.py
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from benchmarks.load_test import DEFAULT_QUESTIONS, percentile
+
+# Offline benchmark suite for the retriever, the RAG pipeline (arun_rag) and the /ask endpoint.
+# Everything runs in-process against local stand-ins (see stand_ins.py), so it needs no OpenAI key,
+# Postgres, Redis or network and its numbers are comparable from run to run:
+#   - the dataset JSON is embedded with HashEmbeddings into a memory-mapped index (rag.memory_index)
+#     and served by the RETRIEVER_BACKEND=memory retriever;
+#   - query embeddings go through the same CachedEmbeddings wrapper (in-process tier only);
+#   - the LLM is a ScriptedChatModel with --llm-latency seconds of latency;
+#   - /ask is called through httpx's ASGI transport, so routing, validation, the concurrency limiter
+#     and timeouts are exercised without a server (startup handlers are not run).
+# Suites:
+#   retriever  per-query latency percentiles, plus hit rate and MRR for question titles, whose
+#              expected result is the question they belong to
+#   rag        arun_rag latency percentiles and throughput at each concurrency level
+#   ask        the same for POST /ask
+# Results can be saved with --json and compared with a saved baseline with --baseline: the run
+# fails (exit code 1) if a p95 latency grows by more than --max-regression or retrieval quality drops.
+#
+# Usage (from application/backend):
+#   python -m benchmarks.offline_suite --suites retriever rag ask --concurrency 1 8 32 --requests 64 --json results.json
+#   python -m benchmarks.offline_suite --baseline results.json
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "data", "counsel_chat_data", "counsel_chat_data.json")
+OFFLINE_API_KEY = "sk-offline-benchmark"
+
+
+def configure_environment(args):
+    """Point the rag package at the in-memory backend and away from external services.
+    Must run before rag is imported, since rag.chain reads its configuration at import time."""
+    os.environ.update({
+        "OPENAI_API_KEY": OFFLINE_API_KEY,
+        "RETRIEVER_BACKEND": "memory",
+        "RETRIEVER_MODE": "vector",
+        "MEMORY_INDEX_PATH": args.index_dir,
+        "SPECIAL_TOPIC_RESPONSES": "off",
+        "ANSWER_CACHE_BACKEND": "memory" if args.answer_cache else "off",
+    })
+
+
+def load_pipeline(args):
+    """Build the index and swap the stand-ins into the rag package. Returns (retriever, records)."""
+    configure_environment(args)
+    import rag.chain as chain_module
+    import rag.rag_execution as rag_execution
+    from rag import CachedEmbeddings, MemoryVectorIndex
+    from rag.memory_index import export_from_json
+    from benchmarks.stand_ins import HashEmbeddings, ScriptedChatModel
+
+    embeddings = HashEmbeddings(dim=args.dim, latency=args.embedding_latency)
+    start = time.perf_counter()
+    parts = [export_from_json(path, embeddings) for path in args.data]
+    records = [record for part in parts for record in part[0]]
+    question_vectors = [vector for part in parts for vector in part[1]]
+    answers_vectors = [vector for part in parts for vector in part[2]]
+    index = MemoryVectorIndex.build(records, question_vectors, answers_vectors, ivf_lists=args.ivf_lists)
+    index.save(args.index_dir)
+    print(f"Indexed {len(records)} questions in {time.perf_counter() - start:.1f}s ({args.index_dir})")
+
+    query_embeddings = CachedEmbeddings(embeddings, max_size=args.embedding_cache_size)
+    chain_module.retriever.embedding_function = query_embeddings
+    rag_execution.query_embeddings = query_embeddings
+    rag_execution.rag_chain = chain_module.build_rag_chain(
+        ScriptedChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+    )
+    return chain_module.retriever, records
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    result = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+    }
+    if elapsed is not None:
+        result["throughput"] = len(latencies) / elapsed if elapsed else 0.0
+    return result
+
+
+def run_retriever_suite(retriever, records, args):
+    """Time retriever.invoke for question titles and score whether their own question is retrieved."""
+    cases = [(record['metadata']['question_title'], record['question_id'])
+             for record in records if record['metadata'].get('question_title')]
+    cases = random.Random(0).sample(cases, min(args.eval_queries, len(cases)))
+
+    retriever.invoke(cases[0][0])  # Open the index before timing
+    latencies, hits, reciprocal_ranks = [], 0, 0.0
+    for query, expected_id in cases:
+        start = time.perf_counter()
+        documents = retriever.invoke(query)
+        latencies.append(time.perf_counter() - start)
+        ranked_ids = list(dict.fromkeys(doc.metadata['question_id'] for doc in documents))
+        if expected_id in ranked_ids:
+            hits += 1
+            reciprocal_ranks += 1 / (ranked_ids.index(expected_id) + 1)
+
+    result = summarize(latencies)
+    result["hit_rate"] = hits / len(cases)
+    result["mrr"] = reciprocal_ranks / len(cases)
+    return result
+
+
+async def run_concurrent(call, questions, concurrency, total_requests):
+    """Run call(question) total_requests times with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(questions[i % len(questions)])
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(total_requests)))
+    result = summarize(latencies, time.perf_counter() - start, errors)
+    result["concurrency"] = concurrency
+    return result
+
+
+async def run_async_suites(args):
+    import httpx
+    results = {}
+    if "rag" in args.suites:
+        from rag.rag_execution import arun_rag
+        results["rag"] = [await run_concurrent(arun_rag, DEFAULT_QUESTIONS, concurrency, args.requests)
+                          for concurrency in args.concurrency]
+    if "ask" in args.suites:
+        from main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout) as client:
+            async def ask(question):
+                response = await client.post("/ask", json={"question": question})
+                response.raise_for_status()
+
+            results["ask"] = [await run_concurrent(ask, DEFAULT_QUESTIONS, concurrency, args.requests)
+                              for concurrency in args.concurrency]
+    return results
+
+
+def print_results(results):
+    if "retriever" in results:
+        result = results["retriever"]
+        print(f"\nretriever: {result['requests']} queries, hit rate {result['hit_rate']:.3f}, MRR {result['mrr']:.3f}")
+        print(f"{'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'mean (ms)':>9}")
+        print(f"{result['p50'] * 1e3:>9.2f} {result['p95'] * 1e3:>9.2f} {result['p99'] * 1e3:>9.2f} {result['mean'] * 1e3:>9.2f}")
+    for suite in ("rag", "ask"):
+        if suite not in results:
+            continue
+        print(f"\n{suite}:")
+        print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8}")
+        for result in results[suite]:
+            print(f"{result['concurrency']:>11} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>8.2f} "
+                  f"{result['p50']:>8.3f} {result['p95']:>8.3f} {result['p99']:>8.3f}")
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """Return a description of every regression against the baseline results."""
+    regressions = []
+    if "retriever" in results and "retriever" in baseline:
+        for metric in ("hit_rate", "mrr"):
+            if results["retriever"][metric] < baseline["retriever"][metric] - 1e-9:
+                regressions.append(f"retriever {metric} {baseline['retriever'][metric]:.3f} -> {results['retriever'][metric]:.3f}")
+        if results["retriever"]["p95"] > baseline["retriever"]["p95"] * (1 + max_regression):
+            regressions.append(f"retriever p95 {baseline['retriever']['p95'] * 1e3:.2f} ms -> {results['retriever']['p95'] * 1e3:.2f} ms")
+    for suite in ("rag", "ask"):
+        baseline_levels = {level["concurrency"]: level for level in baseline.get(suite, [])}
+        for level in results.get(suite, []):
+            before = baseline_levels.get(level["concurrency"])
+            if before is None:
+                continue
+            if level["p95"] > before["p95"] * (1 + max_regression):
+                regressions.append(f"{suite} p95 at concurrency {level['concurrency']} {before['p95']:.3f}s -> {level['p95']:.3f}s")
+            if level["errors"] > before["errors"]:
+                regressions.append(f"{suite} errors at concurrency {level['concurrency']} {before['errors']} -> {level['errors']}")
+    return regressions
+
+
+def main(args):
+    retriever, records = load_pipeline(args)
+    results = {"settings": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")}}
+    if "retriever" in args.suites:
+        results["retriever"] = run_retriever_suite(retriever, records, args)
+    results.update(asyncio.run(run_async_suites(args)))
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the retriever, RAG pipeline and /ask offline with local stand-ins.")
+    parser.add_argument("--suites", nargs="+", choices=("retriever", "rag", "ask"), default=["retriever", "rag", "ask"])
+    parser.add_argument("--data", nargs="+", default=[DEFAULT_DATA], help="Dataset JSON files to index")
+    parser.add_argument("--index-dir", default=os.path.join(tempfile.gettempdir(), "rag_offline_benchmark_index"))
+    parser.add_argument("--ivf-lists", type=int, default=0, help="IVF lists in the index (0 = exact search)")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--eval-queries", type=int, default=200, help="Question titles used by the retriever suite")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrency levels for rag and ask")
+    parser.add_argument("--requests", type=int, default=64, help="Requests sent at each concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the scripted LLM replies")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed LLM tokens")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per uncached query embedding")
+    parser.add_argument("--embedding-cache-size", type=int, default=1024, help="Query embeddings kept in-process")
+    parser.add_argument("--answer-cache", action="store_true", help="Enable the in-memory semantic answer cache")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request client timeout in seconds for /ask")
+    parser.add_argument("--json", help="Save the results to this file")
+    parser.add_argument("--baseline", help="Compare with results saved by an earlier --json run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95 latency increase")
+    main(parser.parse_args())
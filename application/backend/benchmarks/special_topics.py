@@ -0,0 +1,80 @@
+# application/benchmarks/special_topics.py
+import argparse
+import json
+import os
+import re
+import time
+
+# Importing rag.utils runs rag/__init__.py, which builds the chains in rag/chain.py and needs an OpenAI
+# key to be set; no call is made with it, so a placeholder is enough
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+from rag.utils import topics, is_special_topic
+
+# Microbenchmark for special-topic detection (is_special_topic).
+# Compares the previous implementation, which built and ran one regex per phrase for every call,
+# with the precompiled single-pass matcher in rag/utils.py on typical short queries and on full
+# retrieved documents ("Question: ...\nAnswer: ..." built from counsel_chat_data.json), and checks
+# that both return the same topic for every input. Only the matchers are timed, but importing rag.utils
+# loads the whole rag package: it runs with a placeholder OpenAI key (set below when none is set) and
+# without Postgres or Redis, which are only reported as unreachable.
+#
+# Usage (from application/backend):
+#   python -m benchmarks.special_topics --repeat 20
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "data", "counsel_chat_data", "counsel_chat_data.json")
+
+TYPICAL_QUERIES = [
+    "hi", "Hello there!", "good evening", "thanks a bunch", "ok bye", "who are you?", "what can you do?",
+    "I can't sleep at night and I feel anxious all the time",
+    "How do I tell my partner I need more space without hurting them?",
+    "My therapist says I should take care of myself, but how?",
+    "What are the early signs of depression in teenagers?",
+    "Is it normal to feel sad after a breakup even months later?",
+]
+
+def is_special_topic_per_phrase(query):
+    """The previous implementation: one re.search per phrase."""
+    query = query.lower().strip()
+    for topic, phrases in topics.items():
+        for phrase in phrases:
+            if re.search(r'\b' + re.escape(phrase) + r'\b', query):
+                return topic
+    return None
+
+def load_documents(path):
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    return [f"Question: {question['question_full']}\nAnswer: {answer['answer']}"
+            for question in questions for answer in question["answers"]]
+
+def time_matcher(matcher, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            matcher(text)
+    return (time.perf_counter() - start) / (repeat * len(texts))
+
+def main(args):
+    documents = load_documents(args.data)
+    # Fuzz-style check on top of the real inputs: every phrase alone, inside words and with punctuation
+    phrases = [phrase for topic_phrases in topics.values() for phrase in topic_phrases]
+    edge_cases = [variant for phrase in phrases
+                  for variant in (phrase, f"x{phrase}", f"{phrase}x", f"well, {phrase}!", f"{phrase.upper()} and hi")]
+
+    for text in TYPICAL_QUERIES + documents + edge_cases:
+        expected, actual = is_special_topic_per_phrase(text), is_special_topic(text)
+        if expected != actual:
+            raise AssertionError(f"Topic mismatch for {text[:80]!r}: expected {expected}, got {actual}")
+
+    print(f"{len(TYPICAL_QUERIES)} queries, {len(documents)} documents, {len(edge_cases)} edge cases: topics match")
+    print(f"{'input':<10} {'per-phrase us':>14} {'compiled us':>12} {'speedup':>8}")
+    for name, texts, repeat in (("queries", TYPICAL_QUERIES, args.repeat * 50), ("documents", documents, args.repeat)):
+        before = time_matcher(is_special_topic_per_phrase, texts, repeat) * 1e6
+        after = time_matcher(is_special_topic, texts, repeat) * 1e6
+        print(f"{name:<10} {before:>14.1f} {after:>12.1f} {before / after:>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark special-topic detection.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="JSON array of questions used to build documents")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
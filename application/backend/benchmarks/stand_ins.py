@@ -0,0 +1,92 @@
+# application/benchmarks/stand_ins.py
+import asyncio
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from rag.context_assembly import hashed_text_vectors
+
+# Deterministic local stand-ins for the OpenAI embedding and chat models, used by the offline
+# benchmark suite (offline_suite.py) so the retriever, the RAG pipeline and /ask can be measured
+# without network access, API keys or per-token costs.
+# HashEmbeddings maps text to unit-length hashed bag-of-words vectors: the same text always gets the
+# same vector, and texts sharing words are similar, which is enough for retrieval to be meaningful.
+# ScriptedChatModel replies with scripted answers after a configurable delay (and per-token delay
+# when streaming); the async paths sleep with asyncio.sleep, so concurrent requests overlap the way
+# real API calls do.
+
+TOKEN_PATTERN = re.compile(r"\S+\s*")
+
+DEFAULT_SCRIPTED_RESPONSE = """It is understandable to feel this way, and the experts agree that support is available.
+
+## Key points regarding your question
+- Nature of the concept/issue: The experts describe it as a common experience.
+- Professional perspectives: Talking to a licensed therapist is recommended.
+
+## Consensus among experts
+- Reaching out for help is a sign of strength.
+
+## Specific insights or recommendations mentioned
+- Keep a regular routine.
+- Practice breathing exercises when you feel overwhelmed."""
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dim: int = 1536, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.model = f"hash-{dim}"  # Keeps CachedEmbeddings keys apart from the real model's
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return hashed_text_vectors(texts, self.dim).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return hashed_text_vectors([text], self.dim)[0].tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return hashed_text_vectors([text], self.dim)[0].tolist()
+
+
+class ScriptedChatModel(BaseChatModel):
+    responses: List[str] = [DEFAULT_SCRIPTED_RESPONSE]
+    latency: float = 0.5        # Seconds before the reply (or its first token) arrives
+    token_latency: float = 0.0  # Seconds between streamed tokens
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    def _next_response(self) -> str:
+        response = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        return response
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._next_response()))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._next_response()))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in TOKEN_PATTERN.findall(self._next_response()):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in TOKEN_PATTERN.findall(self._next_response()):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,109 @@
+# application/benchmarks/vector_payload.py
+import argparse
+import json
+import os
+import struct
+import time
+import numpy as np
+
+# Benchmark the per-query cost of returning question vectors from the retriever.
+# Compares the three ways a kNN result of 20 rows can carry its question vectors:
+#   text   - question_vector::text parsed with json.loads (the previous behaviour)
+#   binary - vector_send(question_vector) decoded with np.frombuffer (include_vectors=True)
+#   none   - no vectors fetched (the default)
+# Sizes are what crosses the wire: psycopg2 uses the text protocol, so a bytea value arrives
+# hex-encoded ("\x" then 2 characters per byte), about twice its raw size, and is unescaped by
+# libpq before np.frombuffer sees it. The offline mode builds those payloads locally (timing the hex
+# decoding too), so it runs anywhere. With --live it also runs the three queries against the database
+# configured in .env and reports the size of each payload as sent by the server.
+#
+# Usage (from application/backend):
+#   python -m benchmarks.vector_payload --rows 20 --dim 1536 --repeat 200 [--live]
+
+def text_payload(vectors):
+    # pgvector renders vectors as '[v1,v2,...]' with shortest round-trip float formatting
+    return ["[" + ",".join(repr(float(x)) for x in vector) + "]" for vector in vectors]
+
+def binary_payload(vectors):
+    return [struct.pack(">HH", len(vector), 0) + vector.astype(">f4").tobytes() for vector in vectors]
+
+def hex_payload(binary):
+    # How the text protocol sends bytea (bytea_output = 'hex', the default)
+    return ["\\x" + b.hex() for b in binary]
+
+def time_decode(decode, payload, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        decode(payload)
+    return (time.process_time() - start) / repeat * 1000
+
+def run_offline(rows, dim, repeat):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(scale=0.03, size=(rows, dim)).astype(np.float32)
+    text = text_payload(vectors)
+    wire = hex_payload(binary_payload(vectors))
+
+    results = {
+        "text": (sum(len(t) for t in text), time_decode(lambda p: [json.loads(t) for t in p], text, repeat)),
+        "binary": (sum(len(h) for h in wire),
+                   time_decode(lambda p: [np.frombuffer(bytes.fromhex(h[2:]), dtype=">f4", offset=4).astype(np.float32)
+                                          for h in p], wire, repeat)),
+        "none": (0, 0.0),
+    }
+
+    print(f"Offline decode of {rows} rows x {dim} dims ({repeat} repeats)")
+    print(f"{'mode':<8} {'wire bytes':>14} {'CPU ms/query':>14}")
+    for mode, (size, cpu_ms) in results.items():
+        print(f"{mode:<8} {size:>14,} {cpu_ms:>14.3f}")
+    return results
+
+def run_live(repeat):
+    import psycopg2
+    from dotenv import load_dotenv
+    load_dotenv()
+    connection_string = (f"postgresql://{os.getenv('PG_ADMIN_USERNAME')}:{os.getenv('PG_ADMIN_PASSWORD')}"
+                         f"@{os.getenv('PG_SERVER_NAME')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('PG_DATABASE')}")
+    columns = {
+        "text": "question_vector::text AS payload",
+        "binary": "vector_send(question_vector) AS payload",
+        "none": "NULL::bytea AS payload",
+    }
+    decoders = {
+        "text": lambda value: json.loads(value),
+        "binary": lambda value: np.frombuffer(value, dtype=">f4", offset=4).astype(np.float32),
+        "none": lambda value: None,
+    }
+
+    with psycopg2.connect(connection_string) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT question_vector::text FROM talk LIMIT 1")
+            query = cur.fetchone()[0]
+            print(f"\nLive queries against talk ({repeat} repeats)")
+            print(f"{'mode':<8} {'payload bytes':>14} {'wall ms/query':>14} {'client CPU ms':>14}")
+            for mode, column in columns.items():
+                sql = f"""
+                    SELECT question_id, {column}
+                    FROM talk ORDER BY question_vector <=> %s::vector LIMIT 20
+                """
+                # payload::text is the form the text protocol sends (hex for bytea)
+                cur.execute(f"SELECT coalesce(sum(octet_length(payload::text)), 0) FROM ({sql}) AS knn", (query,))
+                size = cur.fetchone()[0]
+                wall, cpu = time.perf_counter(), time.process_time()
+                for _ in range(repeat):
+                    cur.execute(sql, (query,))
+                    for _, payload in cur.fetchall():
+                        decoders[mode](payload)
+                wall = (time.perf_counter() - wall) / repeat * 1000
+                cpu = (time.process_time() - cpu) / repeat * 1000
+                print(f"{mode:<8} {size:>14,} {wall:>14.2f} {cpu:>14.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare text, binary and no vector payloads for kNN results.")
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--live", action="store_true", help="Also query the database configured in .env")
+    args = parser.parse_args()
+    run_offline(args.rows, args.dim, args.repeat)
+    if args.live:
+        run_live(args.repeat)
@@ -1,14 +1,21 @@
 # main.py
 import os
+import asyncio
+import json
+import time
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import redis
 import uuid
 import uvicorn
-from openai import OpenAI, AuthenticationError, APIConnectionError, RateLimitError, BadRequestError
-from rag.rag_execution import run_rag
+import psycopg2
+from openai import OpenAI, AuthenticationError, APIConnectionError, APITimeoutError, RateLimitError, BadRequestError
+from rag.rag_execution import arun_rag, astream_rag
+from rag import postgres_pool, postgres_retriever, retriever, answer_cache, special_topic_responses, user_rag_chains, hash_api_key
+from rag import query_embeddings, context_assembler, metrics, request_trace, PoolTimeoutError, EmbeddingUnavailableError
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,10 +40,6 @@ except redis.ConnectionError as e:
     redis_client = None
     print(f"Redis connection failed: {e}")
 
-# Helper function to get the OpenAI client with a specific API key
-def get_openai_client(api_key: str):
-    return OpenAI(api_key=api_key)
-
 # Helper functions for storing and retrieving API keys from Redis
 def store_api_key(session_id: str, api_key: str):
     if redis_client:
@@ -48,8 +51,23 @@ def get_api_key(session_id: str):
 # Create FastAPI app instance
 app = FastAPI()
 
-# Initialise OpenAI client with API key from environment variables
-client = get_openai_client(os.getenv("OPENAI_API_KEY"))
+# How long API key validation results are cached in Redis (by key hash)
+API_KEY_VALID_TTL_SECONDS = int(os.getenv("API_KEY_VALID_TTL_SECONDS", "86400"))  # Keys that worked
+API_KEY_INVALID_TTL_SECONDS = int(os.getenv("API_KEY_INVALID_TTL_SECONDS", "300"))  # Keys that were rejected
+
+# Limit how many questions are processed at once and how long each one may take
+MAX_CONCURRENT_QUESTIONS = int(os.getenv("MAX_CONCURRENT_QUESTIONS", "32"))  # Questions processed concurrently
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "10"))      # Max wait for a free processing slot
+RAG_TIMEOUT_SECONDS = float(os.getenv("RAG_TIMEOUT_SECONDS", "60"))          # Max time to answer a single question
+rag_semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUESTIONS)
+questions_in_flight = 0
+
+# Serve Prometheus-style metrics on /metrics and optionally print one JSON log line per question
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+metrics.structured_logs = os.getenv("STRUCTURED_LOGS", "false").lower() == "true"
+
+# Reload the canned special-topic replies this often (0 = only at startup)
+SPECIAL_TOPIC_REFRESH_SECONDS = float(os.getenv("SPECIAL_TOPIC_REFRESH_SECONDS", "0"))
 
 # Models for request validation
 class QuestionRequest(BaseModel):
@@ -66,18 +84,38 @@ def get_session_id(request: Request, response: Response):
         response.set_cookie(key="session_id", value=session_id)
     return session_id
 
+# Helper functions for caching API key validation results in Redis, keyed by a hash of the key
+def get_cached_api_key_validity(api_key: str):
+    if not redis_client:
+        return None
+    try:
+        value = redis_client.get(f"api_key_valid:{hash_api_key(api_key)}")
+    except redis.RedisError:
+        return None
+    return None if value is None else value == "1"
+
+def cache_api_key_validity(api_key: str, valid: bool):
+    if not redis_client:
+        return
+    ttl = API_KEY_VALID_TTL_SECONDS if valid else API_KEY_INVALID_TTL_SECONDS
+    try:
+        redis_client.set(f"api_key_valid:{hash_api_key(api_key)}", "1" if valid else "0", ex=ttl)
+    except redis.RedisError:
+        pass
+
 # Function to validate the OpenAI API key for >=1.0.0
+# Listing the models is free and only checks authentication, unlike a chat completion.
 def validate_openai_api_key(api_key: str) -> bool:
+    cached = get_cached_api_key_validity(api_key)
+    if cached is not None:
+        return cached
+
     try:
-        temp_client = get_openai_client(api_key)
-        temp_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "Say hello"}],
-            max_tokens=5
-        )
-        return True
+        with OpenAI(api_key=api_key, max_retries=0, timeout=10) as temp_client:
+            temp_client.models.list()
+        valid = True
     except AuthenticationError:
-        return False
+        valid = False
     except APIConnectionError:
         raise HTTPException(status_code=500, detail="Network error while connecting to OpenAI.")
     except RateLimitError:
@@ -87,6 +125,128 @@ def validate_openai_api_key(api_key: str) -> bool:
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+    cache_api_key_validity(api_key, valid)
+    return valid
+
+# The RAG chain for a session: the user's own API key if they submitted one (from the per-key pool),
+# otherwise None for the default chain
+def get_session_chain(session_id: str):
+    api_key = get_api_key(session_id) if session_id else None
+    return user_rag_chains.get(api_key) if api_key else None
+
+# Map an error raised while answering a question to an HTTP status and message, and count it
+def error_status(e: Exception):
+    if isinstance(e, asyncio.TimeoutError):
+        status, detail = 504, "Timed out while processing question."
+    elif isinstance(e, PoolTimeoutError):
+        status, detail = 503, "Database is busy. Try again shortly."
+    elif isinstance(e, psycopg2.OperationalError):
+        status, detail = 503, "Database is unavailable. Try again shortly."
+    elif isinstance(e, EmbeddingUnavailableError):
+        status, detail = 503, "Embedding service is unavailable. Try again shortly."
+    elif isinstance(e, RateLimitError):
+        status, detail = 429, "Rate limit exceeded. Try again later."
+    elif isinstance(e, AuthenticationError):
+        status, detail = 401, "OpenAI rejected the API key."
+    elif isinstance(e, APITimeoutError):
+        status, detail = 504, "Timed out waiting for OpenAI."
+    elif isinstance(e, APIConnectionError):
+        status, detail = 502, "Network error while connecting to OpenAI."
+    else:
+        status, detail = 500, f"Error processing question: {str(e)}"
+    metrics.inc("rag_errors_total", error=type(e).__name__, status=str(status))
+    return status, detail
+
+# Run the async RAG pipeline behind the concurrency limiter and per-request timeout
+async def answer_question(question: str, chain=None) -> str:
+    global questions_in_flight
+    with request_trace("/ask") as trace:
+        try:
+            await asyncio.wait_for(rag_semaphore.acquire(), timeout=QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            trace["status"] = 503
+            metrics.inc("rag_errors_total", error="QueueTimeout", status="503")
+            raise HTTPException(status_code=503, detail="Server is busy. Try again shortly.")
+
+        questions_in_flight += 1
+        try:
+            return await asyncio.wait_for(arun_rag(question, chain), timeout=RAG_TIMEOUT_SECONDS)
+        except Exception as e:
+            trace["status"], detail = error_status(e)
+            trace["error"] = type(e).__name__
+            raise HTTPException(status_code=trace["status"], detail=detail)
+        finally:
+            questions_in_flight -= 1
+            rag_semaphore.release()
+
+# Format a Server-Sent Event
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Stream the answer as Server-Sent Events behind the same concurrency limiter and timeout as /ask.
+# Errors after the stream has started can no longer change the HTTP status, so they are sent as an error event.
+async def stream_answer(question: str, chain=None):
+    global questions_in_flight
+    with request_trace("/ask/stream") as trace:
+        try:
+            await asyncio.wait_for(rag_semaphore.acquire(), timeout=QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            trace["status"] = 503
+            metrics.inc("rag_errors_total", error="QueueTimeout", status="503")
+            yield sse_event({"detail": "Server is busy. Try again shortly."}, event="error")
+            return
+
+        questions_in_flight += 1
+        deadline = time.monotonic() + RAG_TIMEOUT_SECONDS
+        chunks = astream_rag(question, chain)
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                yield sse_event({"token": text})
+            yield sse_event({}, event="done")
+        except Exception as e:
+            # The stream has started, so the status only goes into the error event, the trace and the metrics
+            trace["status"], detail = error_status(e)
+            trace["error"] = type(e).__name__
+            yield sse_event({"detail": detail, "status": trace["status"]}, event="error")
+        finally:
+            await chunks.aclose()
+            questions_in_flight -= 1
+            rag_semaphore.release()
+
+# Report the counters and sizes the caches, pools and limiter already keep, on every /metrics scrape
+def collect_component_stats():
+    for name, value in query_embeddings.stats().items():
+        if name not in ("lru_size", "hit_rate"):
+            yield "rag_embedding_cache_events_total", "counter", "Query embedding lookups and errors, by event", {"event": name}, value
+    yield "rag_embedding_cache_entries", "gauge", "Query embeddings held in the in-process LRU", {}, query_embeddings.stats()["lru_size"]
+    if answer_cache:
+        yield "rag_answer_cache_entries", "gauge", "Answers held in the semantic answer cache", {}, answer_cache.stats()["entries"]
+    pool = postgres_pool.stats()
+    for state in ("in_use", "idle"):
+        yield "rag_pg_pool_connections", "gauge", "PostgreSQL pool connections, by state", {"state": state}, pool[state]
+    yield "rag_pg_pool_max_connections", "gauge", "PostgreSQL pool size limit", {}, pool["max_size"]
+    yield "rag_pg_pool_waiting", "gauge", "Requests waiting for a PostgreSQL connection", {}, pool["waiting"]
+    yield "rag_pg_pool_saturation", "gauge", "Share of the PostgreSQL pool size in use", {}, pool["in_use"] / pool["max_size"] if pool["max_size"] else 0.0
+    if special_topic_responses:
+        for topic, replies in special_topic_responses.stats()["topics"].items():
+            yield "rag_special_topic_replies", "gauge", "Loaded special-topic replies, by topic", {"topic": topic}, replies
+    yield "rag_questions_in_flight", "gauge", "Questions being answered", {}, questions_in_flight
+    yield "rag_questions_max_concurrent", "gauge", "Limit on questions answered at once", {}, MAX_CONCURRENT_QUESTIONS
+    keys = user_rag_chains.stats()
+    yield "rag_user_chains", "gauge", "RAG chains kept for user API keys", {}, keys["keys"]
+    yield "rag_user_chain_builds_total", "counter", "RAG chains built for user API keys", {}, keys["builds"]
+    if context_assembler:
+        for name, value in context_assembler.stats().items():
+            if name != "max_tokens":
+                yield "rag_context_answers_total", "counter", "Retrieved answers seen by context assembly, by fate", {"fate": name}, value
+
+metrics.register_collector(collect_component_stats)
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -100,29 +260,93 @@ app.add_middleware(
     expose_headers=["Content-Type"]
 )
 
+def load_special_topic_responses():
+    try:
+        print(f"Loaded {special_topic_responses.load(postgres_pool)} special-topic replies")
+    except Exception as e:
+        print(f"Loading special-topic replies failed: {e}")
+
+async def refresh_special_topic_responses():
+    while True:
+        await asyncio.sleep(SPECIAL_TOPIC_REFRESH_SECONDS)
+        await asyncio.to_thread(load_special_topic_responses)
+
+# Open the database connection pool, check the kNN query plan (or the memory-mapped index), load the
+# special-topic replies and restore cached answers at startup, close the pool on shutdown.
+# With RETRIEVER_BACKEND=memory, Postgres is only used to load the special-topic replies, which
+# opens a connection on demand, so the pool is not warmed up.
+@app.on_event("startup")
+def open_connection_pool():
+    if retriever is postgres_retriever:
+        try:
+            postgres_pool.warm_up()
+            print("PostgreSQL connection pool ready")
+        except Exception as e:
+            print(f"PostgreSQL connection pool warm-up failed: {e}")
+
+    try:
+        retriever.check_index_usage()
+    except Exception as e:
+        print(f"Retriever index check failed: {e}")
+
+    if special_topic_responses:
+        load_special_topic_responses()
+
+    if answer_cache:
+        try:
+            print(f"Loaded {answer_cache.load()} cached answers")
+        except Exception as e:
+            print(f"Loading cached answers failed: {e}")
+
+# Load the tokenizer used for the context token budget in the background, since tiktoken may have to
+# download it; until it is loaded, token counts are estimated from the text length
+@app.on_event("startup")
+async def load_token_encoding():
+    if context_assembler:
+        asyncio.create_task(asyncio.to_thread(context_assembler.load_encoding))
+
+@app.on_event("startup")
+async def schedule_special_topic_refresh():
+    if special_topic_responses and SPECIAL_TOPIC_REFRESH_SECONDS > 0:
+        asyncio.create_task(refresh_special_topic_responses())
+
+@app.on_event("shutdown")
+def close_connection_pool():
+    postgres_pool.close()
+
 # FastAPI Endpoints
 @app.post("/ask")
 async def ask_question(request: Request, question_request: QuestionRequest, response: Response):
     session_id = get_session_id(request, response)
-    api_key = get_api_key(session_id)
-
-    if api_key:
-        client = get_openai_client(api_key)
-    else:
-        client = get_openai_client(os.getenv("OPENAI_API_KEY"))
+    chain = get_session_chain(session_id)
 
-    try:
-        response_text = run_rag(question_request.question)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+    response_text = await answer_question(question_request.question, chain)
 
     return {"answer": response_text}
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: Request, question_request: QuestionRequest):
+    chain = get_session_chain(request.cookies.get("session_id"))
+    streaming_response = StreamingResponse(
+        stream_answer(question_request.question, chain),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # Stop proxies from buffering the stream
+    )
+    get_session_id(request, streaming_response)
+    return streaming_response
+
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/submit-api-key")
 async def submit_api_key(request: Request, api_key_request: ApiKeyRequest, response: Response):
     session_id = get_session_id(request, response)
 
-    if not validate_openai_api_key(api_key_request.api_key):
+    # Validation makes a blocking HTTP request (unless cached), so it runs off the event loop
+    if not await asyncio.to_thread(validate_openai_api_key, api_key_request.api_key):
         raise HTTPException(status_code=400, detail="Invalid OpenAI API key.")
 
     store_api_key(session_id, api_key_request.api_key)
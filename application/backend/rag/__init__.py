@@ -1,20 +1,58 @@
 # application/rag/__init__.py
 
 # Imports used classes/ functions
-from .retriever import PostgresRetriever
-from .chain import postgres_retriever, rag_chain
-from .utils import is_special_topic, get_single_response, post_process_rag_output
-from .rag_execution import run_rag
+from .metrics import metrics, stage, request_trace, LLMMetricsCallback
+from .connection_pool import PostgresConnectionPool, PoolTimeoutError
+from .embedding_cache import CachedEmbeddings, EmbeddingUnavailableError
+from .answer_cache import SemanticAnswerCache
+from .scoring import AnswerScorer
+from .retriever import PostgresRetriever, create_connection_pool
+from .memory_index import MemoryVectorIndex
+from .memory_retriever import MemoryMappedRetriever
+from .special_topics import SpecialTopicResponses
+from .key_pool import ApiKeyChainPool, hash_api_key
+from .context_assembly import ContextAssembler, ContextAssemblingRetriever
+from .chain import postgres_pool, query_embeddings, answer_cache, special_topic_responses, postgres_retriever, retriever, context_assembler, rag_chain, user_rag_chains
+from .utils import is_special_topic, get_single_response, post_process_rag_output, StreamingSectionFormatter
+from .rag_execution import run_rag, arun_rag, astream_rag
 
 
 __all__ = [
+    'metrics',
+    'stage',
+    'request_trace',
+    'LLMMetricsCallback',
+    'PostgresConnectionPool',
+    'PoolTimeoutError',
+    'CachedEmbeddings',
+    'EmbeddingUnavailableError',
+    'SemanticAnswerCache',
+    'AnswerScorer',
     'PostgresRetriever',  
+    'create_connection_pool',
+    'MemoryVectorIndex',
+    'MemoryMappedRetriever',
+    'SpecialTopicResponses',
+    'ApiKeyChainPool',
+    'hash_api_key',
+    'ContextAssembler',
+    'ContextAssemblingRetriever',
+    'postgres_pool',
+    'query_embeddings',
+    'answer_cache',
+    'special_topic_responses',
     'rag_chain', 
+    'user_rag_chains',
     'postgres_retriever', 
+    'retriever',
+    'context_assembler',
     'is_special_topic', 
     'get_single_response', 
     'post_process_rag_output',  
-    'run_rag'
+    'StreamingSectionFormatter',
+    'run_rag',
+    'arun_rag',
+    'astream_rag'
 ]
 
 VERSION = "1.0.0"
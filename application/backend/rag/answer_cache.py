@@ -0,0 +1,208 @@
+# application/rag/answer_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import redis
+
+# Define a semantic cache of formatted answers keyed by question embedding.
+# A new question whose embedding is at least `threshold` cosine-similar to a previously answered
+# question gets the cached answer back, skipping retrieval and the LLM call.
+# Entries live in a preallocated float32 matrix so a lookup is a single matrix-vector product.
+# Eviction is LRU once max_entries is reached, and entries expire after ttl_seconds.
+# With the "redis" backend every entry is also written to Redis (with the same TTL) and its key is
+# added to a sorted set indexed by the time it was stored. load() restores the newest entries at
+# startup, and a lookup that misses locally first pulls in the entries other workers stored since the
+# last pull, so answers survive restarts and are shared by all workers. Entries that cannot be decoded
+# or have another dimension are skipped, and when Redis is unreachable the cache backs off and runs
+# on the local entries alone. Keys include the embedding model, as in embedding_cache.py, so vectors
+# of different models are never compared.
+
+SYNC_OVERLAP_SECONDS = 5.0  # Re-read this much of the index on each pull, for clock skew between workers
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl_seconds: int = 24 * 3600,
+        backend: str = "memory",
+        redis_client: Optional[redis.Redis] = None,
+        namespace: str = "answer",
+        model: str = "",
+        redis_retry_interval: float = 30.0,
+    ):
+        if backend not in ("memory", "redis"):
+            raise ValueError(f"Unknown answer cache backend: {backend}")
+        if backend == "redis" and redis_client is None:
+            raise ValueError("The redis answer cache backend needs a redis_client.")
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.redis_client = redis_client
+        self.redis_retry_interval = redis_retry_interval
+        self.namespace = f"{namespace}:{model}" if model else namespace
+        self.index_key = f"{self.namespace}:index"  # Sorted set of entry keys, scored by time stored
+
+        self._lock = threading.Lock()
+        self._vectors = None          # (max_entries, dim) matrix of unit-length question embeddings
+        self._expires = np.zeros(max_entries)
+        self._answers = [None] * max_entries
+        self._keys = [None] * max_entries
+        self._slots = OrderedDict()   # key -> slot, ordered from least to most recently used
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._synced_at = 0.0
+        self._redis_disabled_until = 0.0
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0, "redis_errors": 0, "bad_entries": 0}
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _key(self, question: str) -> str:
+        digest = hashlib.sha256(" ".join(question.lower().split()).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Return the cached answer of the most similar question above the threshold, if any.
+        With the redis backend a local miss makes a Redis round trip, so call it off the event loop."""
+        query = self._normalize(embedding)
+        answer = self._lookup_local(query)
+        if answer is None and self.backend == "redis" and self._pull(self._synced_at - SYNC_OVERLAP_SECONDS):
+            answer = self._lookup_local(query)
+        with self._lock:
+            self._counts["misses" if answer is None else "hits"] += 1
+        return answer
+
+    def _lookup_local(self, query: np.ndarray) -> Optional[str]:
+        with self._lock:
+            if self._vectors is None or not self._slots or query.shape[0] != self._vectors.shape[1]:
+                return None
+
+            similarities = self._vectors @ query
+            similarities[self._expires <= time.time()] = -1.0  # Expired and empty slots never match
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < self.threshold:
+                return None
+
+            self._slots.move_to_end(self._keys[slot])
+            return self._answers[slot]
+
+    def store(self, question: str, embedding: List[float], answer: str):
+        """Cache the formatted answer for a question, evicting the least recently used entry if full."""
+        vector = self._normalize(embedding)
+        key = self._key(question)
+        expires = time.time() + self.ttl_seconds
+        self._store_local(key, vector, answer, expires)
+
+        if self.backend == "redis" and self._redis_available():
+            now = time.time()
+            try:
+                pipe = self.redis_client.pipeline()
+                pipe.hset(key, mapping={"vector": vector.tobytes(), "answer": answer.encode("utf-8")})
+                pipe.expire(key, self.ttl_seconds)
+                pipe.zadd(self.index_key, {key: now})
+                pipe.zremrangebyscore(self.index_key, "-inf", now - self.ttl_seconds)  # Drop expired keys
+                pipe.expire(self.index_key, self.ttl_seconds)
+                pipe.execute()
+            except redis.RedisError:
+                self._redis_failed()
+
+    def _store_local(self, key: str, vector: np.ndarray, answer: str, expires: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            elif vector.shape != (self._vectors.shape[1],):
+                raise ValueError(f"Expected a {self._vectors.shape[1]}-dimensional embedding, got shape {vector.shape}")
+
+            if key in self._slots:
+                slot = self._slots[key]
+                self._slots.move_to_end(key)
+            elif self._free:
+                slot = self._free.pop()
+                self._slots[key] = slot
+            else:
+                _, slot = self._slots.popitem(last=False)
+                self._counts["evictions"] += 1
+                self._slots[key] = slot
+
+            self._vectors[slot] = vector
+            self._expires[slot] = expires
+            self._keys[slot] = key
+            self._answers[slot] = answer
+
+    def load(self) -> int:
+        """Restore the newest unexpired entries from Redis (redis backend only). Returns the number of
+        entries loaded."""
+        if self.backend != "redis":
+            return 0
+        return self._pull(time.time() - self.ttl_seconds)
+
+    # Redis
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_disabled_until
+
+    def _redis_failed(self):
+        # Back off so an unreachable Redis does not add a timeout to every lookup
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_interval
+        with self._lock:
+            self._counts["redis_errors"] += 1
+
+    def _pull(self, since: float) -> int:
+        """Copy the entries stored in Redis since `since` (at most max_entries, newest first) that are
+        not held locally. Returns the number of entries added."""
+        if not self._redis_available():
+            return 0
+        pulled_at = time.time()
+        try:
+            keys = self.redis_client.zrevrangebyscore(self.index_key, "+inf", since, start=0, num=self.max_entries)
+            keys = [key.decode("utf-8") if isinstance(key, bytes) else key for key in keys]
+            with self._lock:
+                keys = [key for key in keys if key not in self._slots]
+            if not keys:
+                self._synced_at = pulled_at
+                return 0
+            pipe = self.redis_client.pipeline()
+            for key in keys:
+                pipe.hgetall(key)
+                pipe.ttl(key)
+            replies = pipe.execute()
+        except redis.RedisError:
+            self._redis_failed()
+            return 0
+        self._synced_at = pulled_at
+
+        loaded = 0
+        # Oldest first, so the newest entries end up most recently used
+        for key, entry, ttl in reversed(list(zip(keys, replies[::2], replies[1::2]))):
+            if not entry or ttl is None or ttl <= 0:
+                continue  # Expired since it was indexed
+            try:
+                vector = np.frombuffer(entry[b"vector"], dtype=np.float32)
+                self._store_local(key, vector, entry[b"answer"].decode("utf-8"), time.time() + ttl)
+            except (KeyError, ValueError, UnicodeDecodeError):
+                # Malformed, or written for an embedding of another dimension
+                with self._lock:
+                    self._counts["bad_entries"] += 1
+                continue
+            loaded += 1
+        return loaded
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters, the hit rate and the current number of entries."""
+        with self._lock:
+            counts = dict(self._counts)
+            counts["entries"] = len(self._slots)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = counts["hits"] / lookups if lookups else 0.0
+        return counts
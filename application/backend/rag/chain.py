@@ -1,21 +1,71 @@
 # application/rag/chain.py
 import os
+import redis
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 from langchain.prompts import PromptTemplate
-from rag import PostgresRetriever
+from rag import PostgresRetriever, create_connection_pool, CachedEmbeddings, SemanticAnswerCache, AnswerScorer
+from rag import SpecialTopicResponses, ApiKeyChainPool, MemoryMappedRetriever, ContextAssembler, ContextAssemblingRetriever
+from rag import LLMMetricsCallback
 
 # Load environment variables from .env
 load_dotenv()
 
 # Set up LLM and embeddings
 openai_api_key = os.getenv("OPENAI_API_KEY")
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, openai_api_key=openai_api_key) #Instantiating a Language Model 
-#llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5, openai_api_key=openai_api_key)
+
+# Time every LLM call (and its first streamed token) and count its tokens (see rag/metrics.py)
+llm_metrics = LLMMetricsCallback()
+
+def create_llm(api_key):
+    return ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, openai_api_key=api_key, #Instantiating a Language Model 
+                      callbacks=[llm_metrics], stream_usage=True) # stream_usage reports token usage for streamed answers too
+    #return ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5, openai_api_key=api_key)
+
+llm = create_llm(openai_api_key)
 embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
+# Retrieve by vector search, by vector + full-text search fused with RRF, or by full-text search only
+retrieval_mode = os.getenv('RETRIEVER_MODE', 'vector') # 'vector', 'hybrid' or 'lexical' (hybrid/lexical need talk.search_vector)
+# Optionally retrieve from an in-process, memory-mapped copy of the talk table instead of Postgres
+# (RETRIEVER_BACKEND=memory); build it with `python -m rag.memory_index` (see memory_index.py)
+retriever_backend = os.getenv('RETRIEVER_BACKEND', 'postgres')  # 'postgres' or 'memory'
+
+# Cache query embeddings in-process and in Redis so repeated questions skip the embedding API.
+# This client stores raw float32 bytes, so unlike the one in main.py it does not decode responses.
+cache_redis_client = redis.Redis(
+    host=os.getenv("REDIS_HOST", "localhost"),
+    port=int(os.getenv("REDIS_PORT", "6379")),
+    socket_timeout=1,
+    socket_connect_timeout=1
+)
+query_embeddings = CachedEmbeddings(
+    embeddings,
+    redis_client=cache_redis_client,
+    max_size=int(os.getenv('EMBEDDING_CACHE_SIZE', '1024')),                  # Entries kept in the in-process LRU
+    ttl_seconds=int(os.getenv('EMBEDDING_CACHE_TTL_SECONDS', '604800')),       # Lifetime of Redis entries
+    timeout_seconds=float(os.getenv('EMBEDDING_TIMEOUT_SECONDS', '0')) or None, # Async calls slower than this fail (0 = no limit)
+    # API skipped this long after a transient failure; only when retrieval can fall back to full-text search
+    api_retry_interval=float(os.getenv('EMBEDDING_RETRY_SECONDS', '30')) if retrieval_mode != 'vector' and retriever_backend == 'postgres' else 0.0
+)
+
+# Optionally cache formatted answers so paraphrases of previously answered questions skip retrieval
+# and the LLM. Off by default: with ada-002 embeddings, different mental-health questions often have a
+# cosine similarity above 0.95, so a user could get an answer written for someone else's question.
+# Set ANSWER_CACHE_BACKEND to "memory" or "redis" (shared and persistent) to turn it on, and keep
+# ANSWER_CACHE_THRESHOLD high.
+answer_cache_backend = os.getenv('ANSWER_CACHE_BACKEND', 'off')
+answer_cache = None if answer_cache_backend == 'off' else SemanticAnswerCache(
+    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')),             # Min cosine similarity for a hit
+    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000')),            # LRU eviction beyond this
+    ttl_seconds=int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '86400')),           # Lifetime of each cached answer
+    backend=answer_cache_backend,
+    redis_client=cache_redis_client,
+    model=embeddings.model  # Keeps answers cached for another embedding model apart
+)
+
 # Get PostgreSQL connection string and collection name from environment variables
 
 # Get PostgreSQL connection details from environment variables
@@ -25,17 +75,85 @@ host = os.getenv('PG_SERVER_NAME')                # Get the server name stored i
 port = os.getenv('POSTGRES_PORT')                 # Get the Standard PostgreSQL port stored in .env file
 database = os.getenv('PG_DATABASE')               # Get the database name stored in .env file
 collection_name = os.getenv('PG_COLLECTION_NAME') # Get the PostgreSQL table name from which documents are retrieved stored in .env file
+search_mode = os.getenv('RETRIEVER_SEARCH_MODE', 'questions') # 'questions' or 'answers' (needs talk_answers, see STORE_ANSWER_VECTORS)
 
 # The PostgreSQL connection string 
 POSTGRESQL_CONNECTION = f"postgresql://{username}:{password}@{host}:{port}/{database}"
 
+# Create a shared connection pool so concurrent requests reuse warm database connections
+postgres_pool = create_connection_pool(
+    POSTGRESQL_CONNECTION,
+    search_mode=search_mode,
+    retrieval_mode=retrieval_mode,
+    min_size=int(os.getenv('PG_POOL_MIN_SIZE', '1')),                      # Connections opened at startup
+    max_size=int(os.getenv('PG_POOL_MAX_SIZE', '10')),                     # Upper bound on open connections
+    acquire_timeout=float(os.getenv('PG_POOL_TIMEOUT', '10')),             # Seconds to wait for a free connection
+    connect_timeout=int(os.getenv('PG_CONNECT_TIMEOUT', '10')),            # Seconds to wait when opening a connection
+    statement_timeout_ms=int(os.getenv('PG_STATEMENT_TIMEOUT_MS', '15000')), # Server-side limit for each query
+    ivfflat_probes=int(os.getenv('PG_IVFFLAT_PROBES', '10')),              # ivfflat lists scanned per query (recall vs speed)
+    hnsw_ef_search=int(os.getenv('PG_HNSW_EF_SEARCH', '40'))               # HNSW candidate list size (recall vs speed)
+)
+
+# Score answers by question relevance, answer relevance and how much we trust the answer's source
+answer_scorer = AnswerScorer(
+    document_weight=0.4,  # Weight of the question's similarity to the query
+    answer_weight=0.4,    # Weight of the answers' similarity to the query
+    trust_weight=0.2,     # Weight of the source trust score
+    trust_scores={'AskTheraRAGBuddy': 0.5, 'Mental Health Dataset': 0.75},  # Any other source (Counselchat) gets 1.0
+    default_trust=1.0
+)
+
 # Create an instance of the PostgresRetriever class
 postgres_retriever = PostgresRetriever(
     connection_string=POSTGRESQL_CONNECTION, # PostgreSQL connection string
     collection_name=collection_name,  # Name of the collection storing documents
-    embedding_function=embeddings # Embedding function to generate query vectors
+    embedding_function=query_embeddings, # Cached embedding function to generate query vectors
+    connection_pool=postgres_pool, # Shared pool of warm connections
+    scorer=answer_scorer, # Scoring weights and source trust table
+    search_mode=search_mode, # Search question vectors or per-answer vectors
+    retrieval_mode=retrieval_mode, # Vector search, vector + full-text fused with RRF, or full-text only
+    rrf_k=int(os.getenv('RETRIEVER_RRF_K', '60')), # Reciprocal rank fusion constant
+    candidate_pool=int(os.getenv('RETRIEVER_CANDIDATE_POOL', '20')), # Nearest questions (or answers) scored
+    top_k=int(os.getenv('RETRIEVER_TOP_K', '10')) # Answers passed to the LLM
+)
+
+# The memory-mapped retriever only does vector search by question (see memory_retriever.py)
+if retriever_backend == 'memory':
+    if search_mode != 'questions':
+        print(f"Warning: RETRIEVER_SEARCH_MODE={search_mode} is not supported by RETRIEVER_BACKEND=memory; searching by question")
+    if retrieval_mode != 'vector':
+        print(f"Warning: RETRIEVER_MODE={retrieval_mode} is not supported by RETRIEVER_BACKEND=memory; using vector search "
+              "with no full-text fallback when the embedding API is unavailable")
+    retriever = MemoryMappedRetriever(
+        index_path=os.getenv('MEMORY_INDEX_PATH', 'memory_index'), # Directory written by rag.memory_index
+        embedding_function=query_embeddings, # Same cached query embeddings as the Postgres retriever
+        scorer=answer_scorer, # Same scoring weights and source trust table
+        candidate_pool=int(os.getenv('RETRIEVER_CANDIDATE_POOL', '20')), # Nearest questions scored
+        top_k=int(os.getenv('RETRIEVER_TOP_K', '10')), # Answers passed to the LLM
+        nprobe=int(os.getenv('MEMORY_INDEX_NPROBE', '8')) # IVF lists searched (if the index has them)
+    )
+else:
+    retriever = postgres_retriever
+
+# Canned replies for greetings, farewells, thanks and "about" questions, loaded into memory at startup
+# (see main.py), so these queries skip the embedding API and Postgres. Set SPECIAL_TOPIC_RESPONSES=off
+# to pick the reply from retrieved documents instead.
+special_topic_responses = None if os.getenv('SPECIAL_TOPIC_RESPONSES', 'preload') == 'off' else SpecialTopicResponses()
+
+# Assemble the retrieved answers into the prompt context: answers are grouped under one copy of their
+# question, near-duplicate answers are dropped and the context is kept within a token budget.
+# Set CONTEXT_ASSEMBLY=off to pass every retrieved Document to the prompt as it is.
+context_assembler = None if os.getenv('CONTEXT_ASSEMBLY', 'on') == 'off' else ContextAssembler(
+    max_tokens=int(os.getenv('CONTEXT_MAX_TOKENS', '2000')),                     # Token budget for the retrieved context
+    lambda_mult=float(os.getenv('CONTEXT_MMR_LAMBDA', '0.7')),                   # MMR trade-off: 1 = relevance only
+    duplicate_threshold=float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', '0.9'))   # Answers this similar count as duplicates
 )
 
+# Per-answer embeddings exist only in talk_answers, so in "answers" search mode fetch them with the
+# candidates and let the assembler compare answers by embedding instead of by hashed words
+if context_assembler and search_mode == 'answers':
+    postgres_retriever.include_vectors = True
+
 CUSTOM_PROMPT = PromptTemplate(
     input_variables=["context", "input"],
     template="""
@@ -76,8 +194,20 @@ Your summarized response:
 """
 )
 
-# Create the chain that processes retrieved documents & generates a response using the llm and CUSTOM_PROMPT
-document_chain = create_stuff_documents_chain(llm, CUSTOM_PROMPT)
+def build_rag_chain(chain_llm):
+    # Create the chain that processes retrieved documents & generates a response using the llm and CUSTOM_PROMPT
+    document_chain = create_stuff_documents_chain(chain_llm, CUSTOM_PROMPT)
+
+    # Create a RAG chain that retrieves documents & generates a response using document_chain
+    if context_assembler is None:
+        return create_retrieval_chain(retriever, document_chain)
+    return create_retrieval_chain(ContextAssemblingRetriever(retriever=retriever, assembler=context_assembler), document_chain)
 
-# Create a RAG chain that retrieves documents & generates a response using document_chain
-rag_chain = create_retrieval_chain(postgres_retriever, document_chain)
+rag_chain = build_rag_chain(llm)
+
+# Chains for users who submitted their own API key: the LLM call uses their key, while retrieval keeps
+# the server's embeddings (and their caches). One chain per key is kept and reused across requests.
+user_rag_chains = ApiKeyChainPool(
+    lambda api_key: build_rag_chain(create_llm(api_key)),
+    max_keys=int(os.getenv('USER_CHAIN_POOL_SIZE', '32'))                      # Distinct user keys kept warm
+)
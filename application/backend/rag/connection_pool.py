@@ -0,0 +1,201 @@
+# application/rag/connection_pool.py
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+import psycopg2
+from .metrics import stage
+
+# Define a bounded, thread-safe pool of warm PostgreSQL connections.
+# Opening a new connection to Azure Postgres costs a TCP + TLS + auth handshake, so connections
+# are kept open and handed out to requests as needed. Connections are opened lazily, checked for
+# health before reuse and have the configured session settings applied and prepared statements
+# created once when they are opened.
+# Async callers run their queries on a dedicated executor sized to the pool, so the event loop
+# is never blocked by psycopg2.
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the pool's acquire timeout."""
+
+
+class PostgresConnectionPool:
+    def __init__(
+        self,
+        connection_string: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 10.0,
+        connect_timeout: int = 10,
+        statement_timeout_ms: Optional[int] = None,
+        health_check_interval: float = 30.0,
+        prepared_statements: Optional[Dict[str, str]] = None,
+        session_settings: Optional[Dict[str, Any]] = None,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1.")
+
+        self.connection_string = connection_string
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.health_check_interval = health_check_interval
+        self.prepared_statements = dict(prepared_statements or {})
+        self.session_settings = {name: value for name, value in (session_settings or {}).items() if value is not None}
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)  # Bounds the number of open connections
+        self._idle = []                                      # Stack of (connection, last_used) tuples
+        self._in_use = 0
+        self._waiting = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="pg-pool")
+        self._closed = False
+
+    def _connect(self):
+        """Open a new connection, apply the session settings and create the prepared statements on it."""
+        options = f"-c statement_timeout={self.statement_timeout_ms}" if self.statement_timeout_ms else None
+        conn = psycopg2.connect(
+            self.connection_string,
+            connect_timeout=self.connect_timeout,
+            options=options,
+            keepalives=1,
+            keepalives_idle=30,
+        )
+        # Retrieval queries are read-only, autocommit avoids leaving connections idle in a transaction
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for name, value in self.session_settings.items():
+                    cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+                for statement in self.prepared_statements.values():
+                    cur.execute(statement)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """Check whether an idle connection can be reused."""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check a connection out of the pool, opening a new one if no healthy idle connection exists."""
+        if self._closed:
+            raise PoolTimeoutError("Connection pool is closed.")
+
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise PoolTimeoutError(
+                f"Timed out after {self.acquire_timeout}s waiting for one of {self.max_size} database connections."
+            )
+
+        try:
+            while True:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+                if candidate is None:
+                    conn = self._connect()
+                    break
+                conn, last_used = candidate
+                if self._is_healthy(conn, last_used):
+                    break
+                self._close_quietly(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """Return a connection to the pool, closing it instead if it is broken or discarded."""
+        with self._lock:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                keep = False
+            else:
+                self._idle.append((conn, time.monotonic()))
+                keep = True
+        if not keep:
+            self._close_quietly(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always returns it to the pool."""
+        with stage("pool_acquire"):
+            conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def run(self, fn: Callable[..., Any], *args):
+        """Run fn(connection, *args) on a pooled connection."""
+        with self.connection() as conn:
+            return fn(conn, *args)
+
+    async def arun(self, fn: Callable[..., Any], *args):
+        """Run fn(connection, *args) on a pooled connection without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        # Copy the context so stage timings recorded in the thread reach the request's trace
+        call = functools.partial(contextvars.copy_context().run, self.run, fn, *args)
+        return await loop.run_in_executor(self._executor, call)
+
+    def warm_up(self):
+        """Open min_size connections up front so the first requests find warm connections."""
+        conns = [self.getconn() for _ in range(self.min_size)]
+        for conn in conns:
+            self.putconn(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the pool's usage."""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+            }
+
+    def close(self):
+        """Close all idle connections and stop handing out new ones."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
@@ -0,0 +1,197 @@
+# application/rag/context_assembly.py
+import re
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+import numpy as np
+import tiktoken
+from langchain.schema import BaseRetriever, Document
+from pydantic import Field
+from .metrics import stage
+
+# Define the context-assembly stage that sits between the retriever and the stuff documents chain.
+# The retriever returns one "Question: ...\nAnswer: ..." Document per answer, so a question with
+# several retrieved answers had its full text pasted into the prompt once per answer, and answers
+# that say the same thing (the datasets contain many near-copies) were all sent to the LLM.
+# The assembler:
+#   1. orders the answers by maximal marginal relevance (MMR) and drops near-duplicates, i.e. answers
+#      whose cosine similarity to an already kept answer reaches duplicate_threshold. Similarity uses
+#      the answers' embeddings when the retriever attached them (answer_vector metadata), which the
+#      Postgres retriever does in RETRIEVER_SEARCH_MODE=answers (see chain.py). In the default
+#      "questions" mode no per-answer embedding is stored (talk only has one answers_vector per
+#      question), so hashed bag-of-words vectors of the answer text are used instead; they catch
+#      the near-copies in the datasets, but not paraphrases, and need no extra embedding call;
+#   2. keeps answers in that order while they fit in max_tokens (counted with tiktoken for the chat
+#      model, or estimated from the text length until the encoding is loaded). The encoding is loaded
+#      by load_encoding, which main.py runs in a background thread at startup: tiktoken downloads it
+#      with no timeout when it is not cached, so neither the import nor a request ever waits for it.
+#      The Docker image fills TIKTOKEN_CACHE_DIR at build time so the download never happens there;
+#   3. returns one Document per question, "Question: ...\nAnswer: ...\nAnswer: ...", carrying the
+#      question_id, topic and question_title, the best score and the sources of its answers.
+# ContextAssemblingRetriever plugs the assembler into create_retrieval_chain as a retriever. A
+# RunnableLambda would work too, but LangChain serializes every runnable of the chain on each call and
+# reads a lambda's source code to do so, which costs more CPU than the rest of the request.
+
+HASHED_VECTOR_DIM = 1024
+CHARS_PER_TOKEN = 4  # Rough English average, used when no tiktoken encoding is available
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hashed_text_vectors(texts: List[str], dim: int = HASHED_VECTOR_DIM) -> np.ndarray:
+    """Unit-length term-frequency vectors of texts with words hashed into dim buckets."""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        buckets = [zlib.crc32(word.encode("utf-8")) % dim for word in TOKEN_PATTERN.findall(text.lower())]
+        np.add.at(vectors[row], buckets, 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr_order(relevance: np.ndarray, vectors: np.ndarray, lambda_mult: float = 0.7,
+              duplicate_threshold: float = 0.9) -> List[int]:
+    """Order items by maximal marginal relevance, dropping those too similar to an item already picked.
+    vectors must be unit length. Returns the indices of the kept items in the order they were picked."""
+    similarities = vectors @ vectors.T
+    max_similarity = np.full(len(relevance), -np.inf)
+    remaining = np.ones(len(relevance), dtype=bool)
+    order = []
+    while remaining.any():
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        mmr = np.where(remaining, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        picked = int(np.argmax(mmr))
+        order.append(picked)
+        remaining[picked] = False
+        max_similarity = np.maximum(max_similarity, similarities[picked])
+        remaining &= max_similarity < duplicate_threshold
+    return order
+
+
+class ContextAssembler:
+    def __init__(self, max_tokens: int = 2000, lambda_mult: float = 0.7, duplicate_threshold: float = 0.9,
+                 model: str = "gpt-3.5-turbo"):
+        self.max_tokens = max_tokens
+        self.lambda_mult = lambda_mult
+        self.duplicate_threshold = duplicate_threshold
+        self.model = model
+        self.encoding = None  # Set by load_encoding; token counts are estimated until then
+        self._encoding_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.answers_in = 0
+        self.answers_out = 0
+        self.duplicates_dropped = 0
+        self.over_budget_dropped = 0
+
+    def load_encoding(self) -> bool:
+        """Load the model's tiktoken encoding (downloading it if it is not cached). Blocking, so run it
+        off the event loop. Returns whether token counts are exact from now on."""
+        with self._encoding_lock:
+            if self.encoding is None:
+                try:
+                    self.encoding = tiktoken.encoding_for_model(self.model)
+                except Exception as e:
+                    # Unknown model, or the encoding file cannot be downloaded (offline)
+                    print(f"Estimating context tokens from text length, no tiktoken encoding for {self.model} "
+                          f"({type(e).__name__})")
+        return self.encoding is not None
+
+    def count_tokens(self, text: str) -> int:
+        encoding = self.encoding
+        if encoding is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        encoding = self.encoding
+        if encoding is None:
+            return text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+        return encoding.decode(encoding.encode(text)[:max(max_tokens, 0)])
+
+    def _answer_vectors(self, documents: List[Document], answers: List[str]) -> np.ndarray:
+        if all('answer_vector' in doc.metadata for doc in documents):
+            vectors = np.stack([np.asarray(doc.metadata['answer_vector'], dtype=np.float32) for doc in documents])
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors / np.where(norms == 0, 1, norms)
+        return hashed_text_vectors(answers)
+
+    def assemble(self, documents: List[Document]) -> List[Document]:
+        """Group, deduplicate and budget the retrieved answer Documents (highest score first)."""
+        if not documents:
+            return []
+        questions, answers = zip(*(doc.page_content.partition("\nAnswer: ")[::2] for doc in documents))
+        relevance = np.array([doc.metadata.get('score', 0.0) for doc in documents], dtype=np.float64)
+        order = mmr_order(relevance, self._answer_vectors(documents, list(answers)),
+                          self.lambda_mult, self.duplicate_threshold)
+
+        # Fill the token budget in MMR order; a question's header is paid for by its first kept answer
+        groups: Dict[str, List[int]] = {}
+        used = 0
+        for i in order:
+            question_id = documents[i].metadata.get('question_id', questions[i])
+            cost = self.count_tokens(f"\nAnswer: {answers[i]}")
+            if question_id not in groups:
+                cost += self.count_tokens(f"\n\n{questions[i]}")
+            if used + cost > self.max_tokens:
+                continue
+            groups.setdefault(question_id, []).append(i)
+            used += cost
+
+        truncated_answer: Optional[str] = None
+        if not groups:
+            # Not even the best answer fits: keep it, cut down to what is left after its question
+            best = order[0]
+            groups[documents[best].metadata.get('question_id', questions[best])] = [best]
+            truncated_answer = self.truncate(answers[best], self.max_tokens - self.count_tokens(questions[best]))
+
+        assembled = []
+        for rows in groups.values():
+            first = documents[rows[0]]
+            group_answers = [truncated_answer if truncated_answer is not None else answers[i] for i in rows]
+            sources = list(dict.fromkeys(documents[i].metadata.get('source', '') for i in rows))
+            metadata = {
+                'question_id': first.metadata.get('question_id'),
+                'source': ", ".join(sources),
+                'sources': sources,
+                'score': max(documents[i].metadata.get('score', 0.0) for i in rows),
+                'topic': first.metadata.get('topic', ''),
+                'question_title': first.metadata.get('question_title', ''),
+                'answer_count': len(rows)
+            }
+            page_content = questions[rows[0]] + "".join(f"\nAnswer: {answer}" for answer in group_answers)
+            assembled.append(Document(page_content=page_content, metadata=metadata))
+
+        kept = sum(len(rows) for rows in groups.values())
+        with self._lock:
+            self.answers_in += len(documents)
+            self.answers_out += kept
+            self.duplicates_dropped += len(documents) - len(order)
+            self.over_budget_dropped += len(order) - kept
+        return assembled
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_tokens': self.max_tokens,
+                'answers_in': self.answers_in,
+                'answers_out': self.answers_out,
+                'duplicates_dropped': self.duplicates_dropped,
+                'over_budget_dropped': self.over_budget_dropped,
+            }
+
+
+class ContextAssemblingRetriever(BaseRetriever):
+    retriever: Any = Field(...)  # The retriever whose Documents are assembled
+    assembler: Any = Field(...)  # ContextAssembler
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        documents = self.retriever.invoke(query)
+        with stage("context_assembly"):
+            return self.assembler.assemble(documents)
+
+    async def _aget_relevant_documents(self, query: str) -> List[Document]:
+        documents = await self.retriever.ainvoke(query)
+        with stage("context_assembly"):
+            return self.assembler.assemble(documents)
@@ -0,0 +1,208 @@
+# application/rag/embedding_cache.py
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import openai
+import redis
+from langchain_core.embeddings import Embeddings
+from .metrics import stage
+
+# Define a two-tier cache for query embeddings that wraps any LangChain Embeddings object.
+# Tier 1 is an in-process, size-bounded LRU; tier 2 is Redis, shared by all workers, storing each
+# vector as a compact float32 byte blob with a TTL. Keys are a hash of the normalised query text
+# and the embedding model, so repeated questions skip the embedding API entirely.
+# Redis is optional: when it is unreachable the cache backs off and runs on the LRU alone.
+# The embedding API is guarded the same way: an async call slower than timeout_seconds, or a call
+# that failed for a transient reason (timeout, connection error, rate limit or server error), raises
+# EmbeddingUnavailableError and, when api_retry_interval is set, the API is skipped for that many
+# seconds, so callers such as the hybrid retriever can fall back to lexical search immediately
+# instead of waiting on a slow or failing API for every query. Cached vectors are still served.
+# Errors caused by the request itself (e.g. a 400 for an over-long question or a rejected API key)
+# are raised unchanged and never skip the API for other queries.
+
+
+# Errors that say the embedding service is unavailable, rather than that the request was wrong
+TRANSIENT_API_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class EmbeddingUnavailableError(Exception):
+    """Raised when the embedding API timed out or failed, or is being skipped after a recent failure."""
+
+
+def normalize_query(query: str) -> str:
+    """Normalise a query so trivial case and whitespace differences share a cache entry."""
+    return " ".join(query.lower().split())
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        redis_client: Optional[redis.Redis] = None,
+        max_size: int = 1024,
+        ttl_seconds: int = 7 * 24 * 3600,
+        namespace: str = "embedding",
+        redis_retry_interval: float = 30.0,
+        timeout_seconds: Optional[float] = None,
+        api_retry_interval: float = 0.0,
+    ):
+        self.embeddings = embeddings
+        self.redis_client = redis_client
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.redis_retry_interval = redis_retry_interval
+        self.timeout_seconds = timeout_seconds
+        self.api_retry_interval = api_retry_interval
+        model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.namespace = f"{namespace}:{model}"
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_disabled_until = 0.0
+        self._api_disabled_until = 0.0
+        self._counts = {"lru_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0, "api_errors": 0}
+
+    def cache_key(self, query: str) -> str:
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    # Tier 1: in-process LRU
+
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _lru_put(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    # Tier 2: Redis
+
+    def _redis_available(self) -> bool:
+        return self.redis_client is not None and time.monotonic() >= self._redis_disabled_until
+
+    def _redis_failed(self):
+        # Back off so an unreachable Redis does not add a connect timeout to every query
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_interval
+        self._count("redis_errors")
+
+    def _redis_get(self, key: str) -> Optional[np.ndarray]:
+        if not self._redis_available():
+            return None
+        try:
+            blob = self.redis_client.get(key)
+        except redis.RedisError:
+            self._redis_failed()
+            return None
+        return np.frombuffer(blob, dtype=np.float32) if blob else None
+
+    def _redis_put(self, key: str, vector: np.ndarray):
+        if not self._redis_available():
+            return
+        try:
+            self.redis_client.set(key, vector.tobytes(), ex=self.ttl_seconds)
+        except redis.RedisError:
+            self._redis_failed()
+
+    # Embedding API
+
+    def _check_api_available(self):
+        if time.monotonic() < self._api_disabled_until:
+            raise EmbeddingUnavailableError("Embedding API skipped after a recent failure")
+
+    def _api_failed(self, error: Exception) -> Exception:
+        self._count("api_errors")
+        if not isinstance(error, TRANSIENT_API_ERRORS):
+            return error
+        # Back off so a slow or failing API does not hold up every query until it recovers
+        if self.api_retry_interval > 0:
+            self._api_disabled_until = time.monotonic() + self.api_retry_interval
+        return EmbeddingUnavailableError(f"Embedding API unavailable: {error!r}")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        vector = self._lru_get(key)
+        if vector is not None:
+            self._count("lru_hits")
+            return vector
+        vector = self._redis_get(key)
+        if vector is not None:
+            self._count("redis_hits")
+            self._lru_put(key, vector)
+            return vector
+        self._count("misses")
+        return None
+
+    def _store(self, key: str, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._lru_put(key, vector)
+        self._redis_put(key, vector)
+        return vector
+
+    # LangChain Embeddings interface
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache_key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            self._check_api_available()
+            try:
+                with stage("embed_query"):
+                    embedding = self.embeddings.embed_query(text)
+            except Exception as e:
+                error = self._api_failed(e)
+                if error is e:
+                    raise
+                raise error from e
+            vector = self._store(key, embedding)
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.cache_key(text)
+        vector = await asyncio.to_thread(self._lookup, key)
+        if vector is None:
+            self._check_api_available()
+            try:
+                with stage("embed_query"):
+                    embedding = await asyncio.wait_for(self.embeddings.aembed_query(text), self.timeout_seconds)
+            except Exception as e:
+                error = self._api_failed(e)
+                if error is e:
+                    raise
+                raise error from e
+            vector = await asyncio.to_thread(self._store, key, embedding)
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the overall hit rate."""
+        with self._lock:
+            counts = dict(self._counts)
+            counts["lru_size"] = len(self._lru)
+        lookups = counts["lru_hits"] + counts["redis_hits"] + counts["misses"]
+        counts["hit_rate"] = (counts["lru_hits"] + counts["redis_hits"]) / lookups if lookups else 0.0
+        return counts
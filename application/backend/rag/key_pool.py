@@ -0,0 +1,47 @@
+# application/rag/key_pool.py
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+# Define a bounded pool of RAG chains built per OpenAI API key.
+# Users may submit their own API key, and the LLM call for their questions must be made with it.
+# Building a chain means creating new OpenAI clients (and their HTTP connection pools), so the chain
+# for each key is built once and reused for all of that key's questions, keeping connections warm.
+# At most max_keys chains are kept; the least recently used one is dropped when a new key arrives.
+# Keys are only held inside the chains; the pool itself is indexed by a SHA-256 of the key.
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class ApiKeyChainPool:
+    def __init__(self, factory: Callable[[str], Any], max_keys: int = 32):
+        self.factory = factory
+        self.max_keys = max_keys
+        self._chains: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, api_key: str):
+        """Return the chain for api_key, building it on first use."""
+        key_hash = hash_api_key(api_key)
+        with self._lock:
+            chain = self._chains.get(key_hash)
+            if chain is not None:
+                self._chains.move_to_end(key_hash)
+                self.hits += 1
+                return chain
+            # Built under the lock so concurrent first requests for a key share one set of clients
+            chain = self.factory(api_key)
+            self._chains[key_hash] = chain
+            self.builds += 1
+            if len(self._chains) > self.max_keys:
+                self._chains.popitem(last=False)
+            return chain
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'keys': len(self._chains), 'max_keys': self.max_keys, 'hits': self.hits, 'builds': self.builds}
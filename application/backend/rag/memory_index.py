@@ -0,0 +1,219 @@
+# application/rag/memory_index.py
+import argparse
+import json
+import os
+from typing import List, Optional
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from .retriever import decode_vector
+
+# Define an in-process vector index over the talk table, stored as a directory of files:
+#   question_vectors.npy  float32 (n, dim) unit-length question vectors
+#   answers_vectors.npy   float32 (n, dim) unit-length mean answer vectors (answers_vector)
+#   records.json          question_id, question_full, answers and metadata of every row, in row order
+#   ivf_centroids.npy / ivf_offsets.npy (optional) IVF lists: rows are stored grouped by list and
+#                         list i holds rows ivf_offsets[i]:ivf_offsets[i + 1]
+# The vector files are opened with np.load(mmap_mode='r'), so loading is instant and every worker
+# process shares the same pages through the OS page cache. Search is exact (one matmul over all
+# rows) or, with IVF lists, over the rows of the nprobe lists nearest to each query. Queries are
+# searched in batches with a single matmul per batch.
+# Build the index with:
+#   python -m rag.memory_index --source postgres --output memory_index [--ivf-lists 32]
+#   python -m rag.memory_index --source json --json ../../data/counsel_chat_data/counsel_chat_data.json --output memory_index
+
+QUESTION_VECTORS_FILE = "question_vectors.npy"
+ANSWERS_VECTORS_FILE = "answers_vectors.npy"
+RECORDS_FILE = "records.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_OFFSETS_FILE = "ivf_offsets.npy"
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 20, seed: int = 0):
+    """Cluster unit vectors by cosine similarity. Returns (centroids, assignment of each row)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = vectors[assignments == i]
+            # An empty list keeps its old centroid
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = normalize_rows(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class MemoryVectorIndex:
+    def __init__(self, question_vectors, answers_vectors, records, ivf_centroids=None, ivf_offsets=None):
+        self.question_vectors = question_vectors
+        self.answers_vectors = answers_vectors
+        self.records = records
+        self.ivf_centroids = ivf_centroids
+        self.ivf_offsets = ivf_offsets
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def build(cls, records: List[dict], question_vectors, answers_vectors, ivf_lists: int = 0):
+        """Build an index from talk rows and their vectors, optionally grouping the rows into IVF lists."""
+        question_vectors = normalize_rows(question_vectors)
+        answers_vectors = normalize_rows(answers_vectors)
+        if not ivf_lists:
+            return cls(question_vectors, answers_vectors, list(records))
+        centroids, assignments = spherical_kmeans(question_vectors, min(ivf_lists, len(records)))
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))))
+        return cls(question_vectors[order], answers_vectors[order], [records[i] for i in order],
+                   centroids, offsets.astype(np.int64))
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, QUESTION_VECTORS_FILE), self.question_vectors)
+        np.save(os.path.join(path, ANSWERS_VECTORS_FILE), self.answers_vectors)
+        with open(os.path.join(path, RECORDS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.records, f, ensure_ascii=False)
+        if self.ivf_centroids is not None:
+            np.save(os.path.join(path, IVF_CENTROIDS_FILE), self.ivf_centroids)
+            np.save(os.path.join(path, IVF_OFFSETS_FILE), self.ivf_offsets)
+
+    @classmethod
+    def load(cls, path: str):
+        """Open an index directory, memory-mapping the vectors."""
+        with open(os.path.join(path, RECORDS_FILE), encoding="utf-8") as f:
+            records = json.load(f)
+        ivf_centroids = ivf_offsets = None
+        if os.path.exists(os.path.join(path, IVF_CENTROIDS_FILE)):
+            ivf_centroids = np.load(os.path.join(path, IVF_CENTROIDS_FILE))
+            ivf_offsets = np.load(os.path.join(path, IVF_OFFSETS_FILE))
+        return cls(
+            np.load(os.path.join(path, QUESTION_VECTORS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, ANSWERS_VECTORS_FILE), mmap_mode="r"),
+            records, ivf_centroids, ivf_offsets
+        )
+
+    def _candidate_rows(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        if self.ivf_centroids is None or nprobe >= len(self.ivf_centroids):
+            return None
+        lists = np.argpartition(-(self.ivf_centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([np.arange(self.ivf_offsets[i], self.ivf_offsets[i + 1]) for i in lists])
+
+    def search(self, query_vectors, k: int, nprobe: int = 8, include_vectors: bool = False) -> List[List[dict]]:
+        """Find the k rows nearest to each query by question vector. Returns, per query, result dicts
+        shaped like the Postgres kNN rows (cosine distances included), nearest first."""
+        if nprobe < 1:
+            raise ValueError("nprobe must be at least 1.")
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        if self.ivf_centroids is None or nprobe >= len(self.ivf_centroids):
+            # Exact search: one matmul for the whole batch of queries
+            all_rows = np.arange(len(self))
+            similarities = queries @ self.question_vectors.T
+            return [self._top_rows(query, all_rows, query_similarities, k, include_vectors)
+                    for query, query_similarities in zip(queries, similarities)]
+        results = []
+        for query in queries:
+            rows = self._candidate_rows(query, nprobe)
+            results.append(self._top_rows(query, rows, self.question_vectors[rows] @ query, k, include_vectors))
+        return results
+
+    def _top_rows(self, query, rows, similarities, k, include_vectors) -> List[dict]:
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        top_rows = rows[top]
+        answers_similarities = self.answers_vectors[top_rows] @ query
+        results = []
+        for row, similarity, answers_similarity in zip(top_rows, similarities[top], answers_similarities):
+            result = dict(self.records[row])
+            result['document_distance'] = 1.0 - float(similarity)
+            result['answers_distance'] = 1.0 - float(answers_similarity)
+            if include_vectors:
+                result['question_vector'] = np.array(self.question_vectors[row])
+            results.append(result)
+        return results
+
+
+def export_from_postgres(connection_string: str):
+    """Read the talk rows and their vectors from Postgres."""
+    with psycopg2.connect(connection_string) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT question_id, question_full, answers, metadata,
+                       vector_send(question_vector) AS question_vector_bytes,
+                       vector_send(answers_vector) AS answers_vector_bytes
+                FROM talk
+                WHERE question_vector IS NOT NULL AND answers_vector IS NOT NULL
+                ORDER BY question_id
+            """)
+            rows = cur.fetchall()
+    records = [{key: row[key] for key in ('question_id', 'question_full', 'answers', 'metadata')} for row in rows]
+    question_vectors = np.stack([decode_vector(row['question_vector_bytes']) for row in rows])
+    answers_vectors = np.stack([decode_vector(row['answers_vector_bytes']) for row in rows])
+    return records, question_vectors, answers_vectors
+
+
+def export_from_json(path: str, embeddings, batch_size: int = 500):
+    """Embed the questions and answers of a raw JSON dataset file, the way the loader does."""
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    texts = []
+    for question in questions:
+        texts.append(question['question_full'])
+        texts.extend(answer['answer'] for answer in question['answers'])
+    vectors = np.concatenate([np.asarray(embeddings.embed_documents(texts[i:i + batch_size]), dtype=np.float32)
+                              for i in range(0, len(texts), batch_size)])
+
+    records, question_vectors, answers_vectors, row = [], [], [], 0
+    for question in questions:
+        answer_count = len(question['answers'])
+        question_vectors.append(vectors[row])
+        answers_vectors.append(vectors[row + 1:row + 1 + answer_count].mean(axis=0))
+        row += 1 + answer_count
+        records.append({
+            'question_id': question['question_id'],
+            'question_full': question['question_full'],
+            'answers': question['answers'],
+            'metadata': {
+                'topic': question['topic'],
+                'question_title': question['question_title'],
+                'sources': [answer['source'] for answer in question['answers']]
+            }
+        })
+    return records, np.stack(question_vectors), np.stack(answers_vectors)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build the memory-mapped vector index used by RETRIEVER_BACKEND=memory.")
+    parser.add_argument("--source", choices=("postgres", "json"), default="postgres")
+    parser.add_argument("--json", nargs="+", default=[], help="Dataset JSON files (for --source json)")
+    parser.add_argument("--output", default=os.getenv("MEMORY_INDEX_PATH", "memory_index"))
+    parser.add_argument("--ivf-lists", type=int, default=0, help="Number of IVF lists (0 = exact search only)")
+    args = parser.parse_args(args)
+
+    if args.source == "postgres":
+        from .chain import POSTGRESQL_CONNECTION
+        records, question_vectors, answers_vectors = export_from_postgres(POSTGRESQL_CONNECTION)
+    else:
+        from .chain import embeddings
+        parts = [export_from_json(path, embeddings) for path in args.json]
+        records = [record for part in parts for record in part[0]]
+        question_vectors = np.concatenate([part[1] for part in parts])
+        answers_vectors = np.concatenate([part[2] for part in parts])
+
+    index = MemoryVectorIndex.build(records, question_vectors, answers_vectors, ivf_lists=args.ivf_lists)
+    index.save(args.output)
+    print(f"Wrote {len(index)} rows ({question_vectors.shape[1]}-dim) to {args.output}"
+          + (f" with {len(index.ivf_centroids)} IVF lists" if index.ivf_centroids is not None else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# application/rag/memory_retriever.py
+from langchain.schema import BaseRetriever, Document
+from langchain_core.pydantic_v1 import validator
+from pydantic import Field
+from typing import List, Any
+from .memory_index import MemoryVectorIndex
+from .retriever import build_documents
+from .scoring import AnswerScorer
+from .metrics import stage
+
+# Define a retriever over the in-process, memory-mapped MemoryVectorIndex (see memory_index.py).
+# It is a drop-in alternative to PostgresRetriever for a corpus that fits in RAM: the candidate_pool
+# nearest questions are found with NumPy instead of a kNN query over the network, and their answers
+# are scored and turned into Documents by the same build_documents / AnswerScorer, so the output
+# (page_content, metadata and scores) is the same as PostgresRetriever's in "questions" search mode.
+
+
+class MemoryMappedRetriever(BaseRetriever):
+    index_path: str = Field(...)
+    embedding_function: Any = Field(...)
+    index: Any = None              # MemoryVectorIndex, opened on first use if not supplied
+    include_vectors: bool = False  # Attach each question's vector (float32 NumPy array) to Document.metadata
+    candidate_pool: int = 20       # Number of nearest questions whose answers are scored
+    top_k: int = 10                # Number of answers returned as Documents
+    scorer: Any = None             # AnswerScorer with the score weights and source trust table
+    nprobe: int = 8                # IVF lists searched per query (ignored for an exact index)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @validator("nprobe")
+    def check_nprobe(cls, nprobe):
+        if nprobe < 1:
+            raise ValueError("nprobe (MEMORY_INDEX_NPROBE) must be at least 1.")
+        return nprobe
+
+    def _get_index(self) -> MemoryVectorIndex:
+        if self.index is None:
+            self.index = MemoryVectorIndex.load(self.index_path)
+        return self.index
+
+    def _search(self, query_embeddings) -> List[List[Document]]:
+        with stage("memory_search"):
+            batches = self._get_index().search(query_embeddings, self.candidate_pool, self.nprobe, self.include_vectors)
+        scorer = self.scorer or AnswerScorer()
+        with stage("rerank"):
+            return [build_documents(results, scorer, self.top_k, self.include_vectors) for results in batches]
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        return self._search([self.embedding_function.embed_query(query)])[0]
+
+    async def _aget_relevant_documents(self, query: str) -> List[Document]:
+        query_embedding = await self.embedding_function.aembed_query(query)
+        # Searching takes well under a millisecond for this corpus, so it runs inline on the event loop
+        return self._search([query_embedding])[0]
+
+    def search_many(self, queries: List[str]) -> List[List[Document]]:
+        """Retrieve Documents for several queries with one embedding call and one batched search."""
+        return self._search(self.embedding_function.embed_documents(queries))
+
+    def check_index_usage(self) -> bool:
+        """Open the index at startup and report its size (the counterpart of PostgresRetriever's check)."""
+        index = self._get_index()
+        lists = f", {len(index.ivf_centroids)} IVF lists" if index.ivf_centroids is not None else ""
+        print(f"Memory-mapped index {self.index_path}: {len(index)} questions{lists}")
+        return True
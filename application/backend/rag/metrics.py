@@ -0,0 +1,211 @@
+# application/rag/metrics.py
+import bisect
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Define the in-process metrics of the RAG path, exposed in the Prometheus text format by /metrics.
+#   - Stage spans: `with stage("knn_query"):` times a stage of a request into the
+#     rag_stage_seconds{stage=...} histogram, and into the current request's trace when there is one.
+#   - Request traces: `with request_trace("/ask") as trace:` times a whole request into
+#     rag_request_seconds{endpoint=..., status=...} and collects the stage durations of that request
+#     (the trace is held in a ContextVar, so it follows the request across awaits and
+#     asyncio.to_thread). With structured logs enabled, each trace is printed as one JSON line.
+#   - Counters, e.g. answer cache hits, special-topic short-circuits and LLM tokens (the latter
+#     recorded by LLMMetricsCallback, which also times the LLM call and its first streamed token).
+#   - Collectors: functions called at scrape time that turn the stats() of the caches and pools into
+#     counters and gauges, so components do not need to count twice.
+# Recording is a perf_counter call and a dict update under a lock, a few microseconds per stage.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+current_trace: ContextVar[Optional[dict]] = ContextVar("current_trace", default=None)
+
+
+def format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, dict, float]]]] = []
+        self.structured_logs = False
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, dict, float]]]):
+        """Register a function returning (name, "counter" or "gauge", help, labels, value) samples,
+        called on every scrape."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{format_labels(labels)} {value:g}" for labels, value in sorted(series.items()))
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items(), key=lambda item: item[0]):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        collected: Dict[str, List[Tuple[str, str, dict, float]]] = {}
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, labels, value in collector():
+                    collected.setdefault(name, []).append((kind, help_text, labels, value))
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        for name, samples in sorted(collected.items()):
+            lines.append(f"# HELP {name} {samples[0][1]}")
+            lines.append(f"# TYPE {name} {samples[0][0]}")
+            lines.extend(f"{name}{format_labels(tuple(sorted(labels.items())))} {value:g}" for _, _, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("rag_stage_seconds", "Duration of each stage of the RAG path")
+metrics.describe("rag_request_seconds", "Duration of each request, by endpoint and HTTP status")
+metrics.describe("rag_errors_total", "Failed requests, by error type and HTTP status")
+metrics.describe("rag_answer_cache_lookups_total", "Semantic answer cache lookups, by result")
+metrics.describe("rag_special_topic_replies_total", "Special-topic queries answered without the LLM, by reply source")
+metrics.describe("rag_lexical_fallbacks_total", "Hybrid retrievals answered by full-text search alone")
+metrics.describe("rag_llm_tokens_total", "Tokens used by LLM calls, by kind")
+metrics.describe("rag_llm_calls_total", "LLM calls, by outcome")
+
+
+def record_stage(name: str, elapsed: float):
+    metrics.observe("rag_stage_seconds", elapsed, stage=name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace["stages"][name] = round(trace["stages"].get(name, 0.0) + elapsed, 6)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the RAG path."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def request_trace(endpoint: str):
+    """Trace a request: its stages, outcome and total time. Set trace["status"] before leaving."""
+    trace = {"request_id": uuid.uuid4().hex, "endpoint": endpoint, "status": 200, "stages": {}}
+    token = current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        elapsed = time.perf_counter() - start
+        current_trace.reset(token)
+        metrics.observe("rag_request_seconds", elapsed, endpoint=endpoint, status=str(trace["status"]))
+        if metrics.structured_logs:
+            trace["duration"] = round(elapsed, 6)
+            trace["timestamp"] = time.time()
+            print(json.dumps(trace, default=str))
+
+
+def annotate(**fields):
+    """Add fields (e.g. the answer source) to the current request's trace, if any."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Times LLM calls (and their first streamed token) and counts the tokens they use."""
+
+    def __init__(self):
+        self._starts: Dict[uuid.UUID, list] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        started = self._starts.get(run_id)
+        if started is not None and not started[1]:
+            started[1] = True
+            record_stage("llm_first_token", time.perf_counter() - started[0])
+
+    def _finish(self, run_id, outcome: str):
+        started = self._starts.pop(run_id, None)
+        metrics.inc("rag_llm_calls_total", outcome=outcome)
+        if started is not None:
+            record_stage("llm", time.perf_counter() - started[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, "success")
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            # Streamed responses carry the usage on the final message instead (stream_usage=True)
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    usage = {"prompt_tokens": usage_metadata.get("input_tokens", 0),
+                             "completion_tokens": usage_metadata.get("output_tokens", 0)}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                metrics.inc("rag_llm_tokens_total", usage[kind], kind=kind.replace("_tokens", ""))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "error")
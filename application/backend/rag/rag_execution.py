@@ -1,27 +1,189 @@
 # application/rag/rag_execution.py
-from rag import postgres_retriever, rag_chain  
+import asyncio
+from rag import retriever, rag_chain  
+from rag import query_embeddings, answer_cache, special_topic_responses
 from rag import PostgresRetriever  
 from rag import is_special_topic, get_single_response, post_process_rag_output   
+from rag.utils import StreamingSectionFormatter
+from rag.embedding_cache import EmbeddingUnavailableError
+from rag.metrics import metrics, stage, annotate
 
 # This is the main function to execute the RAG pipeline.
 # It first checks if the user's query matches a special topic, such as a greeting or farewell.
-# If the query matches a special topic, a random answer is selected from the documents
-# retrieved by the Postgres retriever, and the response is returned without post-processing.
-# If the query does not match a special topic, the standard RAG pipeline is used to generate a response.
-# In this case, the response is post-processed before being returned to the user.
+# If the query is one of the question patterns in the preloaded special_topic_responses table (or
+# nearly is), a random canned reply for that pattern is returned straight away, with no embedding
+# call or kNN query. Otherwise a random answer for the topic is selected from the documents
+# retrieved by the retriever (Postgres or the memory-mapped index, see RETRIEVER_BACKEND). Either
+# way the response is returned without post-processing.
+# If the query does not match a special topic (or no retrieved answer fits it), the standard RAG
+# pipeline is used to generate a response, which is post-processed before being returned.
+# chain is the RAG chain to answer with (e.g. one using the user's own API key), rag_chain by default.
+# Standard responses are stored in the semantic answer cache, and a question close enough to one
+# that was already answered gets the cached response without retrieval or an LLM call.
+# When the embedding API is down or too slow the cache is skipped (the question is neither looked
+# up nor stored) and the retriever decides how to answer without it (see RETRIEVER_MODE=hybrid).
+# Each stage is timed (rag/metrics.py), how the query was answered is counted and recorded in the
+# request's trace (answer_source), and the retriever, embeddings and LLM time their own stages.
 
-def run_rag(query):
+def run_rag(query, chain=None):
     topic = is_special_topic(query)
     
-    # If it's a greeting or farewell, retrieve documents from the postgres retriever
+    # If it's a stored greeting or farewell pattern, reply from the preloaded table
+    if topic and special_topic_responses:
+        response = special_topic_responses.get(topic, query)
+        if response:
+            metrics.inc("rag_special_topic_replies_total", source="table")
+            annotate(answer_source="special_topic_table")
+            return response
+
+    # Otherwise retrieve documents from the retriever
     if topic:
-        documents = postgres_retriever.invoke(query)
+        documents = retriever.invoke(query)
         response = get_single_response(documents, topic)
         
         if response:
+            metrics.inc("rag_special_topic_replies_total", source="retrieved")
+            annotate(answer_source="special_topic_retrieved")
             return response
     
+    # Return a cached answer if a similar question was already answered
+    query_embedding = None
+    if answer_cache:
+        try:
+            query_embedding = query_embeddings.embed_query(query)
+        except EmbeddingUnavailableError:
+            pass
+    if query_embedding is not None:
+        with stage("answer_cache_lookup"):
+            cached_response = answer_cache.lookup(query_embedding)
+        metrics.inc("rag_answer_cache_lookups_total", result="miss" if cached_response is None else "hit")
+        if cached_response is not None:
+            annotate(answer_source="answer_cache")
+            return cached_response
+
     # Fallback to the standard RAG response generation if no special topic found
-    response = rag_chain.invoke({"input": query})
-    formatted_response = post_process_rag_output(response)
-    return formatted_response
\ No newline at end of file
+    annotate(answer_source="llm")
+    with stage("rag_chain"):
+        response = (chain or rag_chain).invoke({"input": query})
+    with stage("post_process"):
+        formatted_response = post_process_rag_output(response)
+
+    if query_embedding is not None:
+        answer_cache.store(query, query_embedding, formatted_response)
+    return formatted_response
+
+# Async version of run_rag used by the FastAPI endpoints.
+# Retrieval, embeddings and the LLM call are all awaited, so a slow request no longer
+# blocks the event loop and other questions can be served concurrently.
+
+async def arun_rag(query, chain=None):
+    topic = is_special_topic(query)
+
+    # If it's a stored greeting or farewell pattern, reply from the preloaded table
+    if topic and special_topic_responses:
+        response = special_topic_responses.get(topic, query)
+        if response:
+            metrics.inc("rag_special_topic_replies_total", source="table")
+            annotate(answer_source="special_topic_table")
+            return response
+
+    # Otherwise retrieve documents from the retriever
+    if topic:
+        documents = await retriever.ainvoke(query)
+        response = get_single_response(documents, topic)
+
+        if response:
+            metrics.inc("rag_special_topic_replies_total", source="retrieved")
+            annotate(answer_source="special_topic_retrieved")
+            return response
+
+    # Return a cached answer if a similar question was already answered
+    query_embedding = None
+    if answer_cache:
+        try:
+            query_embedding = await query_embeddings.aembed_query(query)
+        except EmbeddingUnavailableError:
+            pass
+    if query_embedding is not None:
+        with stage("answer_cache_lookup"):
+            # A local miss makes a Redis round trip with the redis backend, so keep it off the event loop
+            cached_response = await asyncio.to_thread(answer_cache.lookup, query_embedding)
+        metrics.inc("rag_answer_cache_lookups_total", result="miss" if cached_response is None else "hit")
+        if cached_response is not None:
+            annotate(answer_source="answer_cache")
+            return cached_response
+
+    # Fallback to the standard RAG response generation if no special topic found
+    annotate(answer_source="llm")
+    with stage("rag_chain"):
+        response = await (chain or rag_chain).ainvoke({"input": query})
+    with stage("post_process"):
+        formatted_response = post_process_rag_output(response)
+
+    if query_embedding is not None:
+        await asyncio.to_thread(answer_cache.store, query, query_embedding, formatted_response)
+    return formatted_response
+
+
+# Streaming version of arun_rag used by the /ask/stream endpoint.
+# Yields the formatted answer piece by piece as the LLM produces tokens, applying the same
+# section formatting as post_process_rag_output incrementally.
+
+async def astream_rag(query, chain=None):
+    topic = is_special_topic(query)
+
+    # If it's a stored greeting or farewell pattern, reply from the preloaded table
+    if topic and special_topic_responses:
+        response = special_topic_responses.get(topic, query)
+        if response:
+            metrics.inc("rag_special_topic_replies_total", source="table")
+            annotate(answer_source="special_topic_table")
+            yield response
+            return
+
+    # Otherwise retrieve documents from the retriever
+    if topic:
+        documents = await retriever.ainvoke(query)
+        response = get_single_response(documents, topic)
+
+        if response:
+            metrics.inc("rag_special_topic_replies_total", source="retrieved")
+            annotate(answer_source="special_topic_retrieved")
+            yield response
+            return
+
+    # Return a cached answer if a similar question was already answered
+    query_embedding = None
+    if answer_cache:
+        try:
+            query_embedding = await query_embeddings.aembed_query(query)
+        except EmbeddingUnavailableError:
+            pass
+    if query_embedding is not None:
+        with stage("answer_cache_lookup"):
+            # A local miss makes a Redis round trip with the redis backend, so keep it off the event loop
+            cached_response = await asyncio.to_thread(answer_cache.lookup, query_embedding)
+        metrics.inc("rag_answer_cache_lookups_total", result="miss" if cached_response is None else "hit")
+        if cached_response is not None:
+            annotate(answer_source="answer_cache")
+            yield cached_response
+            return
+
+    # Fallback to the standard RAG response generation if no special topic found
+    annotate(answer_source="llm")
+    formatter = StreamingSectionFormatter()
+    formatted_parts = []
+    with stage("rag_chain"):
+        async for chunk in (chain or rag_chain).astream({"input": query}):
+            text = formatter.feed(chunk.get("answer", ""))
+            if text:
+                formatted_parts.append(text)
+                yield text
+
+    text = formatter.flush()
+    if text:
+        formatted_parts.append(text)
+        yield text
+
+    if query_embedding is not None:
+        await asyncio.to_thread(answer_cache.store, query, query_embedding, "".join(formatted_parts))
@@ -1,93 +1,368 @@
 # application/rag/retriever.py
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from langchain.schema import BaseRetriever, Document
 from pydantic import Field
 from typing import List, Any
 import json
+import numpy as np
+from psycopg2.extras import RealDictCursor
+from .connection_pool import PostgresConnectionPool
+from .embedding_cache import EmbeddingUnavailableError
+from .metrics import metrics, stage
+from .scoring import AnswerScorer
 
 # Define a Custom Document Retrieval class (PostgresRetriever) that extends LangChain's BaseRetriever  
 # Vector-based retrieval: This uses vector similarity search using the pgvector extension in PostgreSQL.
+# Connections come from a shared PostgresConnectionPool and the kNN query is a prepared statement,
+# so concurrent requests reuse warm connections instead of paying a new handshake on every question.
+# Distances use the cosine operator (<=>) to match the vector_cosine_ops index built by
+# create_vector_index.py, so the ORDER BY ... LIMIT can be served from the ANN index, and
+# relevance is 1 - cosine distance (the cosine similarity).
+# Question vectors are only fetched when include_vectors is set. They are then sent in pgvector's
+# binary format (vector_send) and decoded straight into float32 NumPy arrays, instead of being
+# rendered as text by Postgres and parsed back with json.loads. psycopg2 receives the bytea
+# hex-encoded, so this is about 2.6x fewer bytes than the text form (not 5x) but far less CPU.
+# The candidate_pool nearest questions are fetched and all of their answers are scored by an
+# AnswerScorer (configurable weights and source trust table) to keep the top_k answers.
+# With search_mode="answers" the ANN search runs over the per-answer embeddings in talk_answers
+# instead, so every answer is scored with its own relevance rather than its question's mean
+# answer vector, and candidate_pool is the number of nearest answers fetched.
+# With retrieval_mode="hybrid" a lexical channel is added: full-text search over talk.search_vector
+# (a generated tsvector of the question and its answers with a GIN index, see setup_db_table.py),
+# so exact terms such as medication names or disorders are found even when the embedding is vague.
+# The two rankings are fused with reciprocal rank fusion (score = sum of 1 / (rrf_k + rank)) inside
+# one prepared statement, so hybrid retrieval is still a single round-trip. The fused score, scaled
+# so a question ranked first by both channels gets 1, replaces the question's vector relevance in
+# the AnswerScorer. If the query embedding fails or times out (EmbeddingUnavailableError from
+# CachedEmbeddings) the lexical ranking alone is used, and retrieval_mode="lexical" always uses it
+# and never calls the embedding API. Hybrid and lexical retrieval rank talk rows, whatever search_mode.
+
+KNN_STATEMENT_NAME = "talk_knn"
+KNN_VECTORS_STATEMENT_NAME = "talk_knn_vectors"
+
+KNN_SELECT_SQL = """
+    SELECT question_id, question_full, answers, metadata,
+           question_vector <=> $1 AS document_distance,
+           answers_vector <=> $1 AS answers_distance{vector_columns}
+    FROM talk
+    ORDER BY question_vector <=> $1
+    LIMIT $2
+"""
+
+KNN_PREPARE_SQL = f"PREPARE {KNN_STATEMENT_NAME} (vector, integer) AS" + KNN_SELECT_SQL.format(vector_columns="")
+
+KNN_VECTORS_PREPARE_SQL = f"PREPARE {KNN_VECTORS_STATEMENT_NAME} (vector, integer) AS" + KNN_SELECT_SQL.format(
+    vector_columns=",\n           vector_send(question_vector) AS question_vector_bytes"
+)
+
+ANSWERS_KNN_STATEMENT_NAME = "talk_answers_knn"
+ANSWERS_KNN_VECTORS_STATEMENT_NAME = "talk_answers_knn_vectors"
+
+ANSWERS_KNN_SELECT_SQL = """
+    SELECT a.question_id, t.question_full, t.metadata, a.answer, a.source,
+           t.question_vector <=> $1 AS document_distance,
+           a.answer_distance{vector_columns}
+    FROM (
+        SELECT question_id, answer, source, answer_vector, answer_vector <=> $1 AS answer_distance
+        FROM talk_answers
+        ORDER BY answer_vector <=> $1
+        LIMIT $2
+    ) AS a
+    JOIN talk AS t USING (question_id)
+    ORDER BY a.answer_distance
+"""
+
+ANSWERS_KNN_PREPARE_SQL = f"PREPARE {ANSWERS_KNN_STATEMENT_NAME} (vector, integer) AS" + ANSWERS_KNN_SELECT_SQL.format(
+    vector_columns=""
+)
+
+ANSWERS_KNN_VECTORS_PREPARE_SQL = f"PREPARE {ANSWERS_KNN_VECTORS_STATEMENT_NAME} (vector, integer) AS" + ANSWERS_KNN_SELECT_SQL.format(
+    vector_columns=",\n           vector_send(t.question_vector) AS question_vector_bytes,"
+                   "\n           vector_send(a.answer_vector) AS answer_vector_bytes"
+)
+
+# Prepared statement name for each (search_mode, include_vectors) combination
+KNN_STATEMENTS = {
+    ("questions", False): KNN_STATEMENT_NAME,
+    ("questions", True): KNN_VECTORS_STATEMENT_NAME,
+    ("answers", False): ANSWERS_KNN_STATEMENT_NAME,
+    ("answers", True): ANSWERS_KNN_VECTORS_STATEMENT_NAME,
+}
+
+# Lexical ranking of talk rows for the query text in {query_param}: the query's terms are OR-ed
+# (instead of plainto_tsquery's AND) so long natural-language questions still match, and matches
+# are ranked by ts_rank_cd, which favours question terms (weight A) over answer terms (weight B)
+LEXICAL_RANK_SQL = """
+        SELECT question_id, row_number() OVER (ORDER BY score DESC, question_id) AS rank
+        FROM (
+            SELECT question_id, ts_rank_cd(search_vector, query) AS score
+            FROM talk, replace(plainto_tsquery('english', {query_param})::text, ' & ', ' | ')::tsquery AS query
+            WHERE search_vector @@ query
+            ORDER BY score DESC
+            LIMIT $2
+        ) AS lexical"""
+
+HYBRID_STATEMENT_NAME = "talk_hybrid"
+HYBRID_VECTORS_STATEMENT_NAME = "talk_hybrid_vectors"
+
+# Parameters: $1 query vector, $2 candidates per channel and in total, $3 query text, $4 rrf_k
+HYBRID_SELECT_SQL = """
+    WITH vector_hits AS (
+        SELECT question_id, row_number() OVER (ORDER BY distance, question_id) AS rank
+        FROM (
+            SELECT question_id, question_vector <=> $1 AS distance
+            FROM talk
+            ORDER BY question_vector <=> $1
+            LIMIT $2
+        ) AS nearest
+    ),
+    lexical_hits AS ({lexical_rank}
+    ),
+    fused AS (
+        SELECT question_id, sum(1.0 / ($4 + rank))::float8 AS fused_score
+        FROM (SELECT * FROM vector_hits UNION ALL SELECT * FROM lexical_hits) AS hits
+        GROUP BY question_id
+        ORDER BY fused_score DESC, question_id
+        LIMIT $2
+    )
+    SELECT t.question_id, t.question_full, t.answers, t.metadata,
+           t.question_vector <=> $1 AS document_distance,
+           t.answers_vector <=> $1 AS answers_distance,
+           f.fused_score{{vector_columns}}
+    FROM fused AS f
+    JOIN talk AS t USING (question_id)
+    ORDER BY f.fused_score DESC, t.question_id
+""".format(lexical_rank=LEXICAL_RANK_SQL.format(query_param="$3"))
+
+HYBRID_PREPARE_SQL = f"PREPARE {HYBRID_STATEMENT_NAME} (vector, integer, text, integer) AS" + HYBRID_SELECT_SQL.format(
+    vector_columns=""
+)
+
+HYBRID_VECTORS_PREPARE_SQL = f"PREPARE {HYBRID_VECTORS_STATEMENT_NAME} (vector, integer, text, integer) AS" + HYBRID_SELECT_SQL.format(
+    vector_columns=",\n           vector_send(t.question_vector) AS question_vector_bytes"
+)
+
+LEXICAL_STATEMENT_NAME = "talk_lexical"
+LEXICAL_VECTORS_STATEMENT_NAME = "talk_lexical_vectors"
+
+# Parameters: $1 query text, $2 candidates, $3 rrf_k
+LEXICAL_SELECT_SQL = """
+    WITH lexical_hits AS ({lexical_rank}
+    )
+    SELECT t.question_id, t.question_full, t.answers, t.metadata,
+           (1.0 / ($3 + l.rank))::float8 AS fused_score{{vector_columns}}
+    FROM lexical_hits AS l
+    JOIN talk AS t USING (question_id)
+    ORDER BY l.rank
+""".format(lexical_rank=LEXICAL_RANK_SQL.format(query_param="$1"))
+
+LEXICAL_PREPARE_SQL = f"PREPARE {LEXICAL_STATEMENT_NAME} (text, integer, integer) AS" + LEXICAL_SELECT_SQL.format(
+    vector_columns=""
+)
+
+LEXICAL_VECTORS_PREPARE_SQL = f"PREPARE {LEXICAL_VECTORS_STATEMENT_NAME} (text, integer, integer) AS" + LEXICAL_SELECT_SQL.format(
+    vector_columns=",\n           vector_send(t.question_vector) AS question_vector_bytes"
+)
+
+# Prepared statement name for each (retrieval channel, include_vectors) combination
+FUSION_STATEMENTS = {
+    ("hybrid", False): HYBRID_STATEMENT_NAME,
+    ("hybrid", True): HYBRID_VECTORS_STATEMENT_NAME,
+    ("lexical", False): LEXICAL_STATEMENT_NAME,
+    ("lexical", True): LEXICAL_VECTORS_STATEMENT_NAME,
+}
+
+def decode_vector(data) -> np.ndarray:
+    """Decode pgvector's binary format (uint16 dim, uint16 unused, big-endian float4 values) to float32."""
+    return np.frombuffer(data, dtype='>f4', offset=4).astype(np.float32)
 
 class PostgresRetriever(BaseRetriever):
     connection_string: str = Field(...)
     embedding_function: Any = Field(...)
+    connection_pool: Any = None  # Shared PostgresConnectionPool, created on first use if not supplied
+    include_vectors: bool = False  # Attach each question's vector (float32 NumPy array) to Document.metadata
+    candidate_pool: int = 20       # Number of nearest questions whose answers are scored
+    top_k: int = 10                # Number of answers returned as Documents
+    scorer: Any = None             # AnswerScorer with the score weights and source trust table
+    search_mode: str = "questions" # "questions" (talk) or "answers" (per-answer vectors in talk_answers)
+    retrieval_mode: str = "vector" # "vector", "hybrid" (vector + full-text, fused with RRF) or "lexical"
+    rrf_k: int = 60                # Reciprocal rank fusion constant (larger flattens the rank weights)
 
     class Config:
         arbitrary_types_allowed = True
 
+    def _get_pool(self) -> PostgresConnectionPool:
+        if self.connection_pool is None:
+            self.connection_pool = create_connection_pool(self.connection_string, search_mode=self.search_mode,
+                                                          retrieval_mode=self.retrieval_mode)
+        return self.connection_pool
+
+    def _fetch_candidates(self, conn, query_embedding) -> List[dict]:
+        statement = KNN_STATEMENTS[(self.search_mode, self.include_vectors)]
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"EXECUTE {statement} (%s::vector, %s)", (json.dumps(query_embedding), self.candidate_pool))
+            results = cur.fetchall()
+        if self.search_mode == "answers":
+            results = [answer_row_to_candidate(row) for row in results]
+        return results
+
+    def _fetch_fused_candidates(self, conn, query: str, query_embedding=None) -> List[dict]:
+        """Hybrid (vector + lexical, RRF) candidates, or lexical ones when there is no query embedding."""
+        channel = "lexical" if query_embedding is None else "hybrid"
+        statement = FUSION_STATEMENTS[(channel, self.include_vectors)]
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if query_embedding is None:
+                cur.execute(f"EXECUTE {statement} (%s, %s, %s)", (query, self.candidate_pool, self.rrf_k))
+            else:
+                cur.execute(f"EXECUTE {statement} (%s::vector, %s, %s, %s)",
+                            (json.dumps(query_embedding), self.candidate_pool, query, self.rrf_k))
+            results = cur.fetchall()
+        # Best possible fused score: ranked first by every channel
+        best_score = (1 if query_embedding is None else 2) / (self.rrf_k + 1)
+        return [fused_row_to_candidate(row, best_score) for row in results]
+
+    def _embed_query(self, query: str):
+        """The query embedding, or None when lexical retrieval should be used instead."""
+        if self.retrieval_mode == "lexical":
+            return None
+        try:
+            return self.embedding_function.embed_query(query)
+        except EmbeddingUnavailableError as e:
+            print(f"Falling back to lexical retrieval: {e}")
+            metrics.inc("rag_lexical_fallbacks_total")
+            return None
+
+    async def _aembed_query(self, query: str):
+        if self.retrieval_mode == "lexical":
+            return None
+        try:
+            return await self.embedding_function.aembed_query(query)
+        except EmbeddingUnavailableError as e:
+            print(f"Falling back to lexical retrieval: {e}")
+            metrics.inc("rag_lexical_fallbacks_total")
+            return None
+
     def _get_relevant_documents(self, query: str) -> List[Document]:
-        query_embedding = self.embedding_function.embed_query(query)
-
-        with psycopg2.connect(self.connection_string) as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(f"""
-                    SELECT question_id, question_full, answers, metadata,
-                           question_vector <-> %s::vector AS document_distance,
-                           answers_vector <-> %s::vector AS answers_distance,
-                           question_vector::text as question_vector_text
-                    FROM talk
-                    ORDER BY question_vector <-> %s::vector
-                    LIMIT 20
-                """, (json.dumps(query_embedding), json.dumps(query_embedding), json.dumps(query_embedding)))
-                results = cur.fetchall()
-
-        all_answers = []
-        for result in results:
-            metadata = result['metadata']
-            answers = result['answers']
-            document_relevance = 1 - result['document_distance']
-            answers_relevance = 1 - result['answers_distance']
-            question_vector = json.loads(result['question_vector_text'])
-
-            for answer in answers:
-                answer_text = answer['answer']
-                source = answer['source']
-
-                # Assign trust score based on source
-                if source == 'AskTheraRAGBuddy':
-                    trust_score = 0.5
-                elif source == 'Mental Health Dataset':
-                    trust_score = 0.75
-                else:
-                    trust_score = 1.0
-
-                # Combine document relevance, answer relevance, and trust score
-                combined_score = (
-                    document_relevance * 0.4 +  # Document relevance
-                    answers_relevance * 0.4 +   # Answer relevance
-                    trust_score * 0.2           # Trust score
-                )
-
-                all_answers.append({
-                    'question_id': result['question_id'],
-                    'question_full': result['question_full'],
-                    'answer_text': answer_text,
-                    'source': source,
-                    'score': combined_score,
-                    'metadata': metadata,
-                    'question_vector': question_vector  # Add this line
-                })
-
-        # Sort answers and select top 10
-        sorted_answers = sorted(all_answers, key=lambda x: x['score'], reverse=True)[:10]
-
-        # Create Document objects for the top 10 answers
-        documents = []
-        for answer in sorted_answers:
-            doc = Document(
-                page_content=f"Question: {answer['question_full']}\nAnswer: {answer['answer_text']}",
-                metadata={
-                    'question_id': answer['question_id'],
-                    'source': answer['source'],
-                    'score': answer['score'],
-                    'topic': answer['metadata'].get('topic', ''),
-                    'question_title': answer['metadata'].get('question_title', ''),
-                    'question_vector': answer['question_vector']  # Use this line
-                }
-            )
-            documents.append(doc)
-        return documents
-        
+        if self.retrieval_mode == "vector":
+            query_embedding = self.embedding_function.embed_query(query)
+            with stage("knn_query"):
+                results = self._get_pool().run(self._fetch_candidates, query_embedding)
+        else:
+            query_embedding = self._embed_query(query)
+            with stage("lexical_query" if query_embedding is None else "hybrid_query"):
+                results = self._get_pool().run(self._fetch_fused_candidates, query, query_embedding)
+        return self._build_documents(results)
+
+    def _searched_table(self):
+        return ("talk_answers", "answer_vector") if self.search_mode == "answers" else ("talk", "question_vector")
+
+    def _explain_knn(self, conn) -> str:
+        table, column = self._searched_table()
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {column}::text FROM {table} WHERE {column} IS NOT NULL LIMIT 1")
+            row = cur.fetchone()
+            if row is None:
+                return ""
+            statement = KNN_STATEMENTS[(self.search_mode, False)]
+            cur.execute(f"EXPLAIN EXECUTE {statement} (%s::vector, %s)", (row[0], self.candidate_pool))
+            return "\n".join(line for (line,) in cur.fetchall())
+
+    def check_index_usage(self) -> bool:
+        """Check with EXPLAIN that the kNN query uses a vector index, printing a warning if it would seq-scan."""
+        table, column = self._searched_table()
+        plan = self._get_pool().run(self._explain_knn)
+        if not plan:
+            print(f"Skipped vector index check: the {table} table is empty")
+            return True
+        if f"Seq Scan on {table}" in plan:
+            print(f"WARNING: the kNN query will sequentially scan the {table} table. "
+                  f"Check that a vector_cosine_ops index exists on {column} (see create_vector_index.py).\n" + plan)
+            return False
+        return True
+
     async def _aget_relevant_documents(self, query: str) -> List[Document]:
-        return self._get_relevant_documents(query)
\ No newline at end of file
+        if self.retrieval_mode == "vector":
+            query_embedding = await self.embedding_function.aembed_query(query)
+            with stage("knn_query"):
+                results = await self._get_pool().arun(self._fetch_candidates, query_embedding)
+        else:
+            query_embedding = await self._aembed_query(query)
+            with stage("lexical_query" if query_embedding is None else "hybrid_query"):
+                results = await self._get_pool().arun(self._fetch_fused_candidates, query, query_embedding)
+        return self._build_documents(results)
+
+    def _build_documents(self, results) -> List[Document]:
+        with stage("rerank"):
+            return build_documents(results, self.scorer or AnswerScorer(), self.top_k, self.include_vectors)
+
+
+def build_documents(results, scorer: AnswerScorer, top_k: int, include_vectors: bool = False) -> List[Document]:
+    """Score every answer of the candidate questions and create Documents for the top_k answers."""
+    document_relevance = np.fromiter((1 - result['document_distance'] for result in results), dtype=np.float64, count=len(results))
+    answers_relevance = np.fromiter((1 - result['answers_distance'] for result in results), dtype=np.float64, count=len(results))
+    top_answers = scorer.top_answers(document_relevance, answers_relevance, [result['answers'] for result in results], top_k)
+
+    # Create Document objects for the top answers
+    documents = []
+    for row, answer_index, score in top_answers:
+        result = results[row]
+        answer = result['answers'][answer_index]
+        metadata = result['metadata']
+        doc_metadata = {
+            'question_id': result['question_id'],
+            'source': answer['source'],
+            'score': score,
+            'topic': metadata.get('topic', ''),
+            'question_title': metadata.get('question_title', '')
+        }
+        if include_vectors:
+            # Postgres rows carry pgvector's binary format, in-memory index rows the decoded array
+            doc_metadata['question_vector'] = (result['question_vector'] if 'question_vector' in result
+                                               else decode_vector(result['question_vector_bytes']))
+            if 'answer_vector_bytes' in result:
+                doc_metadata['answer_vector'] = decode_vector(result['answer_vector_bytes'])
+        doc = Document(
+            page_content=f"Question: {result['question_full']}\nAnswer: {answer['answer']}",
+            metadata=doc_metadata
+        )
+        documents.append(doc)
+    return documents
+
+def answer_row_to_candidate(row) -> dict:
+    """Shape an answer-level result like a question-level one with a single answer, so the same
+    scoring applies with the answer's own distance as its answer relevance."""
+    candidate = dict(row)
+    candidate['answers'] = [{'answer': candidate.pop('answer'), 'source': candidate.pop('source')}]
+    candidate['answers_distance'] = candidate.pop('answer_distance')
+    return candidate
+
+def fused_row_to_candidate(row, best_score: float) -> dict:
+    """Use a hybrid or lexical row's fused score, scaled to 0..1, as its document relevance. Lexical rows
+    have no vector distances, so the same relevance also stands in for the answers' relevance."""
+    candidate = dict(row)
+    relevance = candidate.pop('fused_score') / best_score
+    candidate['document_distance'] = 1 - relevance
+    candidate.setdefault('answers_distance', 1 - relevance)
+    return candidate
+
+def create_connection_pool(connection_string: str, search_mode: str = "questions", retrieval_mode: str = "vector",
+                           ivfflat_probes: int = None, hnsw_ef_search: int = None, **kwargs) -> PostgresConnectionPool:
+    """Create a connection pool with the kNN queries for the search mode (and the hybrid/lexical queries for
+    the retrieval mode) registered as prepared statements and the ANN search parameters
+    (ivfflat.probes / hnsw.ef_search) set on every connection."""
+    prepared_statements = {KNN_STATEMENT_NAME: KNN_PREPARE_SQL, KNN_VECTORS_STATEMENT_NAME: KNN_VECTORS_PREPARE_SQL}
+    if search_mode == "answers":
+        # Only prepared when needed, since talk_answers exists only if the loader stored answer vectors
+        prepared_statements[ANSWERS_KNN_STATEMENT_NAME] = ANSWERS_KNN_PREPARE_SQL
+        prepared_statements[ANSWERS_KNN_VECTORS_STATEMENT_NAME] = ANSWERS_KNN_VECTORS_PREPARE_SQL
+    if retrieval_mode != "vector":
+        # Only prepared when needed, since they need the search_vector column (see setup_db_table.py)
+        prepared_statements[HYBRID_STATEMENT_NAME] = HYBRID_PREPARE_SQL
+        prepared_statements[HYBRID_VECTORS_STATEMENT_NAME] = HYBRID_VECTORS_PREPARE_SQL
+        prepared_statements[LEXICAL_STATEMENT_NAME] = LEXICAL_PREPARE_SQL
+        prepared_statements[LEXICAL_VECTORS_STATEMENT_NAME] = LEXICAL_VECTORS_PREPARE_SQL
+    return PostgresConnectionPool(
+        connection_string,
+        prepared_statements=prepared_statements,
+        session_settings={"ivfflat.probes": ivfflat_probes, "hnsw.ef_search": hnsw_ef_search},
+        **kwargs
+    )
@@ -0,0 +1,68 @@
+# application/rag/scoring.py
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Define how retrieved answers are scored and the top answers selected.
+# Every answer of every candidate question gets a combined score of
+#   document relevance * document_weight + answer relevance * answer_weight + trust * trust_weight
+# where trust comes from the answer's source. Scoring is vectorised with NumPy and the top-k answers
+# are picked with a partial partition (np.partition), so the candidate pool can grow to hundreds of
+# questions without a Python loop doing the arithmetic per answer or a full sort of every answer.
+
+DEFAULT_TRUST_SCORES = {
+    'AskTheraRAGBuddy': 0.5,
+    'Mental Health Dataset': 0.75,
+}
+
+
+class AnswerScorer:
+    def __init__(
+        self,
+        document_weight: float = 0.4,
+        answer_weight: float = 0.4,
+        trust_weight: float = 0.2,
+        trust_scores: Optional[Dict[str, float]] = None,
+        default_trust: float = 1.0,
+    ):
+        self.document_weight = document_weight
+        self.answer_weight = answer_weight
+        self.trust_weight = trust_weight
+        self.trust_scores = dict(DEFAULT_TRUST_SCORES if trust_scores is None else trust_scores)
+        self.default_trust = default_trust
+
+    def score(self, document_relevance: np.ndarray, answers_relevance: np.ndarray,
+              answers: Sequence[Sequence[dict]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score every answer. Returns (row index, answer index within the row, score) arrays."""
+        counts = np.fromiter((len(row_answers) for row_answers in answers), dtype=np.int64, count=len(answers))
+        total = int(counts.sum())
+        rows = np.repeat(np.arange(len(answers)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        trust = np.fromiter(
+            (self.trust_scores.get(answer['source'], self.default_trust) for row_answers in answers for answer in row_answers),
+            dtype=np.float64, count=total
+        )
+        scores = (
+            np.repeat(np.asarray(document_relevance, dtype=np.float64), counts) * self.document_weight +
+            np.repeat(np.asarray(answers_relevance, dtype=np.float64), counts) * self.answer_weight +
+            trust * self.trust_weight
+        )
+        return rows, offsets, scores
+
+    def top_answers(self, document_relevance: np.ndarray, answers_relevance: np.ndarray,
+                    answers: Sequence[Sequence[dict]], k: int) -> List[Tuple[int, int, float]]:
+        """Return the k best (row index, answer index, score) triples, highest score first.
+        Ties keep the order in which the answers were retrieved."""
+        rows, offsets, scores = self.score(document_relevance, answers_relevance, answers)
+        if scores.size == 0 or k <= 0:
+            return []
+        if scores.size > k:
+            # Partition to find the k-th best score, then keep the earliest answers among ties at that score
+            kth_score = -np.partition(-scores, k - 1)[k - 1]
+            above = np.flatnonzero(scores > kth_score)
+            ties = np.flatnonzero(scores == kth_score)[:k - above.size]
+            candidates = np.concatenate((above, ties))
+        else:
+            candidates = np.arange(scores.size)
+        # Sort the selected answers by score, breaking ties by retrieval order
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(rows[i]), int(offsets[i]), float(scores[i])) for i in order]
@@ -0,0 +1,121 @@
+# application/rag/special_topics.py
+import difflib
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+from .utils import is_special_topic, extract_answer
+
+# Define an in-memory table of canned replies for the special topics (greetings, farewells, thanks
+# and "about" questions), so these queries are answered without an embedding call or a kNN query.
+# The replies are the conversational rows of the Mental Health Dataset, whose answers have the
+# AskTheraRAGBuddy source (see notebooks/preprocessing_data/mentalhealth_data_preprocessing.ipynb).
+# A reply is kept for a topic when both the row's question and the "Question: ...\nAnswer: ..."
+# document match that topic, the same test get_single_response applies to retrieved documents, and
+# the text returned is the same first line after "Answer:".
+# Each row is one question pattern of a dataset intent (e.g. "Good evening") carrying all of the
+# intent's replies, so replies are kept per normalised pattern. A query is answered from the table
+# only when it is one of these patterns, or nearly (e.g. a typo); is_special_topic also matches
+# words such as "night" or "hi" inside real questions, and those must go on to retrieval.
+# The table is loaded at startup and can be refreshed at any time; a refresh builds a new table and
+# swaps it in, so readers never see it half-built.
+
+DEFAULT_RESPONSE_SOURCES = ('AskTheraRAGBuddy',)
+
+NON_WORD_PATTERN = re.compile(r"[^\w\s]+")
+NEAR_MATCH_CUTOFF = 0.85  # difflib similarity ratio above which a query counts as its pattern
+
+SPECIAL_TOPIC_ROWS_SQL = """
+    SELECT question_full, answers
+    FROM talk
+    WHERE EXISTS (
+        SELECT 1 FROM jsonb_array_elements(answers) AS answer
+        WHERE answer->>'source' = ANY(%s)
+    )
+"""
+
+
+def normalize_pattern(text: str) -> str:
+    """Normalise a question so case, punctuation and whitespace differences match the same pattern."""
+    return " ".join(NON_WORD_PATTERN.sub(" ", text.lower()).split())
+
+
+class SpecialTopicResponses:
+    def __init__(self, sources=DEFAULT_RESPONSE_SOURCES):
+        self.sources = list(sources)
+        self._patterns: Dict[str, Tuple[str, List[str]]] = {}
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+
+    def build(self, rows) -> Dict[str, Tuple[str, List[str]]]:
+        """Group the replies of rows (dicts with question_full and answers) by normalised question
+        pattern. Returns {pattern: (topic, replies)}, each reply listed once per pattern."""
+        patterns: Dict[str, Tuple[str, Dict[str, None]]] = {}
+        for row in rows:
+            topic = is_special_topic(row['question_full'])
+            if not topic:
+                continue
+            pattern = normalize_pattern(row['question_full'])
+            for answer in row['answers']:
+                if answer.get('source') not in self.sources:
+                    continue
+                content = f"Question: {row['question_full']}\nAnswer: {answer['answer']}"
+                if is_special_topic(content) != topic:
+                    continue
+                reply = extract_answer(content)
+                if reply:
+                    patterns.setdefault(pattern, (topic, {}))[1][reply] = None
+        return {pattern: (topic, list(replies)) for pattern, (topic, replies) in patterns.items()}
+
+    def _fetch_rows(self, conn):
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SPECIAL_TOPIC_ROWS_SQL, (self.sources,))
+            return cur.fetchall()
+
+    def load(self, pool) -> int:
+        """(Re)load the table from Postgres through the connection pool. Returns the number of replies."""
+        patterns = self.build(pool.run(self._fetch_rows))
+        with self._lock:
+            self._patterns = patterns
+            self.loaded_at = time.time()
+        return sum(len(replies) for _, replies in patterns.values())
+
+    def get(self, topic: str, query: str) -> Optional[str]:
+        """A random canned reply for the question pattern the query is (or nearly is), or None."""
+        replies = self._pattern_replies(topic, query)
+        with self._lock:
+            if replies:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return random.choice(replies) if replies else None
+
+    def _pattern_replies(self, topic: str, query: str) -> Optional[List[str]]:
+        patterns = self._patterns
+        query = normalize_pattern(query)
+        if query not in patterns:
+            candidates = [pattern for pattern, (pattern_topic, _) in patterns.items()
+                          if pattern_topic == topic]
+            close = difflib.get_close_matches(query, candidates, n=1, cutoff=NEAR_MATCH_CUTOFF)
+            if not close:
+                return None
+            query = close[0]
+        pattern_topic, replies = patterns[query]
+        return replies if pattern_topic == topic else None
+
+    def stats(self) -> dict:
+        topics: Dict[str, int] = {}
+        for topic, replies in self._patterns.values():
+            topics[topic] = topics.get(topic, 0) + len(replies)
+        with self._lock:
+            return {
+                'topics': topics,  # Replies per topic, summed over its patterns
+                'patterns': len(self._patterns),
+                'hits': self.hits,
+                'misses': self.misses,
+                'loaded_at': self.loaded_at,
+            }
@@ -56,14 +56,145 @@ def post_process_rag_output(rag_output):
     
     return formatted_output
 
+class StreamingSectionFormatter:
+    """Apply the post_process_rag_output formatting to an answer that arrives in chunks.
+    feed() returns the formatted text that is safe to emit so far and flush() returns the rest,
+    so the concatenated output equals post_process_rag_output for the full answer. Only a
+    possible section marker after a newline and trailing whitespace/colons are held back."""
+
+    def __init__(self):
+        self._marker = None        # Digits seen after a newline that may still become a "1." marker
+        self._sections = 0         # Number of non-empty sections emitted so far
+        self._in_section = False   # Whether the current section has any non-whitespace text yet
+        self._in_title = False     # Whether we are still on the section's first (title) line
+        self._title_started = False
+        self._held = ''            # Trailing whitespace/colons that may be stripped at the section end
+
+    def feed(self, text):
+        out = []
+        for ch in text:
+            self._feed_char(ch, out)
+        return ''.join(out)
+
+    def flush(self):
+        out = []
+        self._release_marker(out)
+        self._end_section(out)
+        return ''.join(out)
+
+    def _feed_char(self, ch, out):
+        if self._marker is None:
+            if ch == '\n':
+                self._marker = ''
+            else:
+                self._section_char(ch, out)
+            return
+
+        marker = self._marker + ch
+        if marker == '•' or (len(marker) > 1 and marker[-1] == '.' and marker[:-1].isdecimal()):
+            # Matches the '\n\d+\.|\n•' split in post_process_rag_output
+            self._marker = None
+            self._end_section(out)
+        elif marker.isdecimal():
+            self._marker = marker
+        else:
+            self._release_marker(out)
+            self._feed_char(ch, out)
+
+    def _release_marker(self, out):
+        """Feed a newline (and digits) that turned out not to start a new section."""
+        if self._marker is not None:
+            pending, self._marker = '\n' + self._marker, None
+            for c in pending:
+                self._section_char(c, out)
+
+    def _section_char(self, ch, out):
+        if not self._in_section:
+            if ch.isspace():
+                return  # Sections are stripped, so skip leading whitespace
+            if self._sections:
+                out.append('\n')
+            out.append('## ')
+            self._sections += 1
+            self._in_section = True
+            self._in_title = True
+            self._title_started = False
+
+        if self._in_title:
+            if not self._title_started:
+                if ch == ':':
+                    return  # Leading colons are stripped from the title
+                self._title_started = True
+            if ch.isspace() or ch == ':':
+                self._held += ch
+                return
+            if '\n' in self._held:
+                index = self._held.index('\n')
+                out.append(self._held[:index].rstrip(':') + '\n' + self._held[index + 1:])
+                self._in_title = False
+            else:
+                out.append(self._held)
+        elif ch.isspace():
+            self._held += ch
+            return
+        else:
+            out.append(self._held)
+
+        self._held = ''
+        out.append(ch)
+
+    def _end_section(self, out):
+        if not self._in_section:
+            return
+        if self._in_title:
+            tail = self._held.rstrip()
+            if '\n' in tail:
+                index = tail.index('\n')
+                out.append(tail[:index].rstrip(':') + '\n' + tail[index + 1:] + '\n')
+            else:
+                out.append(tail.rstrip(':') + '\n\n')
+        else:
+            out.append('\n')
+        self._held = ''
+        self._in_section = False
+        self._in_title = False
+
+def compile_topic_matcher(topics):
+    """Compile the topic phrases into one regex that finds, in a single pass, every position where a
+    whole-word phrase starts. The zero-width lookahead lets overlapping phrases all be seen, and the
+    alternatives are ordered by topic so the first one that matches at a position has the highest
+    priority topic there. Returns the pattern and each phrase's topic index (its first topic)."""
+    phrase_topics = {}
+    for topic_index, phrases in enumerate(topics.values()):
+        for phrase in phrases:
+            phrase_topics.setdefault(phrase, topic_index)
+    ordered_phrases = sorted(phrase_topics, key=phrase_topics.get)
+    pattern = re.compile(r'(?=\b(' + '|'.join(re.escape(phrase) for phrase in ordered_phrases) + r')\b)')
+    return pattern, phrase_topics
+
+# Compiled once at import instead of building a regex per phrase on every call
+topic_names = list(topics)
+topic_pattern, phrase_topics = compile_topic_matcher(topics)
+
 def is_special_topic(query):
-    """Check if the query matches any special topic (greeting or farewell)."""
+    """Check if the query matches any special topic (greeting or farewell).
+    Phrases match as whole words, and when phrases of several topics occur the first topic in
+    topics wins."""
     query = query.lower().strip()
-    for topic, phrases in topics.items():
-        # Use regular expressions to match whole words to avoid substring issues
-        for phrase in phrases:
-            if re.search(r'\b' + re.escape(phrase) + r'\b', query):
-                return topic
+    best = None
+    for match in topic_pattern.finditer(query):
+        topic_index = phrase_topics[match.group(1)]
+        if best is None or topic_index < best:
+            best = topic_index
+            if best == 0:
+                break
+    return topic_names[best] if best is not None else None
+
+def extract_answer(content):
+    """Return the text of the section marked as "Answer:" in a document, or None."""
+    match = re.search(r'Answer:\s*(.*?)(?:\n|$)', content, re.DOTALL)
+    if match:
+        return match.group(1).strip()
     return None
 
 def get_single_response(documents, topic):
@@ -73,9 +204,9 @@ def get_single_response(documents, topic):
     if relevant_docs:
         content = random.choice(relevant_docs).page_content
         # Look for a section marked as "Answer:"
-        match = re.search(r'Answer:\s*(.*?)(?:\n|$)', content, re.DOTALL)
-        if match:
-            return match.group(1).strip()
+        answer = extract_answer(content)
+        if answer is not None:
+            return answer
     
     # If no match found, return a fallback response
     return "Sorry, I couldn't find a specific answer for that topic."
\ No newline at end of file
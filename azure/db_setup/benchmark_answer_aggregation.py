@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+from answer_aggregation import answer_weights, split_batch_embeddings, aggregate_answer_embeddings
+
+# Compare the loader's old answer aggregation (embeddings as Python float lists averaged with
+# [sum(x) / len(x) for x in zip(*answer_embeddings)]) with the float32 NumPy path, measuring CPU time
+# and peak traced memory. Answer counts come from a local JSON file and the embeddings are random, so
+# no OpenAI calls are made.
+#
+# Usage:
+#   python benchmark_answer_aggregation.py --dim 1536 --repeat 3
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "data", "counsel_chat_data", "counsel_chat_data.json")
+
+def aggregate_lists(embeddings, answer_counts):
+    """The previous loader code path, on a list of Python float lists."""
+    combined, index = [], 0
+    for count in answer_counts:
+        index += 1  # Question embedding
+        answer_embeddings = embeddings[index:index + count]
+        index += count
+        combined.append([sum(x) / len(x) for x in zip(*answer_embeddings)])
+    return combined
+
+def aggregate_numpy(embeddings, answer_counts, sources, weighting):
+    _, answer_embeddings = split_batch_embeddings(embeddings, answer_counts)
+    return aggregate_answer_embeddings(answer_embeddings, answer_counts, answer_weights(sources, weighting))
+
+def measure(fn, make_input, repeat):
+    """Best CPU time and peak traced memory of fn(input), with building the input included in the memory."""
+    best, peak = float("inf"), 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        data = make_input()
+        start = time.process_time()
+        fn(data)
+        best = min(best, time.process_time() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del data
+    return best, peak
+
+def main(args):
+    with open(args.data, encoding="utf-8") as f:
+        questions = json.load(f)
+    answer_counts = [len(question["answers"]) for question in questions]
+    sources = [answer["source"] for question in questions for answer in question["answers"]]
+    rows = len(questions) + len(sources)
+    matrix = np.random.default_rng(0).normal(size=(rows, args.dim)).astype(np.float32)
+
+    print(f"{len(questions)} questions, {len(sources)} answers, {args.dim}-dim embeddings")
+    print(f"{'path':<24} {'best cpu s':>10} {'peak MiB':>10}")
+    cases = (
+        ("python lists (before)", lambda: matrix.tolist(), lambda data: aggregate_lists(data, answer_counts)),
+        ("numpy float32 mean", lambda: matrix.copy(), lambda data: aggregate_numpy(data, answer_counts, sources, "mean")),
+        ("numpy float32 trust", lambda: matrix.copy(), lambda data: aggregate_numpy(data, answer_counts, sources, "trust")),
+    )
+    for name, make_input, fn in cases:
+        seconds, peak = measure(fn, make_input, args.repeat)
+        print(f"{name:<24} {seconds:>10.3f} {peak / 2**20:>10.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark answer-embedding aggregation in the loader.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="JSON array of questions (for answer counts and sources)")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
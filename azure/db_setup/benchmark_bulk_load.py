@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from psycopg2.extras import Json
+from data_loader import connect_to_db, insert_batch
+from bulk_loader import copy_batch
+
+# Compare rows/sec of the batched INSERT path (insert_batch) with the binary COPY path (copy_batch).
+# Rows are built from a local JSON file (by default the bundled counsel_chat_data.json) with
+# deterministic random vectors in place of embeddings, so no OpenAI calls are made. Each path loads
+# into a scratch copy of talk in its own schema, which is dropped afterwards.
+#
+# Usage:
+#   python benchmark_bulk_load.py --batch-size 100 --repeat 3
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "data", "counsel_chat_data", "counsel_chat_data.json")
+BENCH_SCHEMA = "bulk_load_bench"
+
+def build_rows(path, dim, seed=0):
+    """Build talk rows shaped like process_questions_batch output, with fake vectors."""
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for question in questions:
+        vectors = rng.normal(size=(2, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        metadata = {"topic": question["topic"], "question_title": question["question_title"],
+                    "sources": [answer["source"] for answer in question["answers"]]}
+        rows.append((question["question_id"], question["question_full"], Json(question["answers"]),
+                     vectors[0], vectors[1], Json(metadata)))
+    return rows
+
+def time_load(conn, load_batch, rows, batch_size):
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE talk")
+    conn.commit()
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        load_batch(conn, rows[i:i + batch_size])
+    return time.perf_counter() - start
+
+def main(args):
+    rows = build_rows(args.data, args.dim)
+    conn = connect_to_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+            cur.execute(f"CREATE TABLE {BENCH_SCHEMA}.talk (LIKE public.talk INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(f"ALTER TABLE {BENCH_SCHEMA}.talk ADD PRIMARY KEY (question_id)")
+            # Unqualified "talk" in the loaders now resolves to the scratch table
+            cur.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+        conn.commit()
+
+        print(f"Loading {len(rows)} rows ({args.dim}-dim vectors) in batches of {args.batch_size}")
+        print(f"{'method':<16} {'best s':>8} {'rows/s':>10}")
+        for name, load_batch in (("execute_batch", insert_batch), ("binary COPY", copy_batch)):
+            best = min(time_load(conn, load_batch, rows, args.batch_size) for _ in range(args.repeat))
+            print(f"{name:<16} {best:>8.2f} {len(rows) / best:>10.1f}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark execute_batch INSERTs against binary COPY.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="JSON array of questions to load")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,55 @@
+import argparse
+import os
+import tempfile
+import time
+from ingest_to_azure import upload_files_to_adls
+from storage_backend import AzureBlobStorage, LocalBlobStorage
+
+# Measure dataset upload throughput for different numbers of upload workers, and the cost of a
+# re-run where every file is skipped by the MD5 check. Synthetic files are generated in a temporary
+# directory. The default local backend needs no cloud service; --backend azure uses
+# AZURE_CONNECTION_STRING / ADLS_CONTAINER_NAME (point them at Azurite to benchmark offline).
+#
+# Usage:
+#   python benchmark_upload.py --files 16 --size-mb 8 --workers 1 4 8
+
+BENCH_PREFIX = "upload_benchmark"
+
+def make_files(directory, count, size):
+    for i in range(count):
+        with open(os.path.join(directory, f"part-{i:04d}.json"), "wb") as f:
+            f.write(os.urandom(size))
+
+def create_storage(backend, root):
+    if backend == "local":
+        return LocalBlobStorage(root)
+    return AzureBlobStorage(os.getenv("AZURE_CONNECTION_STRING"), os.getenv("ADLS_CONTAINER_NAME"))
+
+def main(args):
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as blob_root:
+        make_files(source, args.files, size)
+        total_mb = args.files * size / 2**20
+        print(f"{args.files} files, {total_mb:.1f} MiB in total, {args.backend} backend")
+        print(f"{'workers':>7} {'upload s':>9} {'MiB/s':>8} {'skip s':>8}")
+        for workers in args.workers:
+            storage = create_storage(args.backend, blob_root)
+            # A fresh prefix per run so nothing is skipped on the first pass
+            mapping = {".": f"{BENCH_PREFIX}/{workers}"}
+            start = time.perf_counter()
+            outcomes = upload_files_to_adls(source, mapping, storage, max_workers=workers)
+            upload_seconds = time.perf_counter() - start
+            if outcomes["failed"]:
+                print(f"{outcomes['failed']} uploads failed")
+            start = time.perf_counter()
+            upload_files_to_adls(source, mapping, storage, max_workers=workers)
+            skip_seconds = time.perf_counter() - start
+            print(f"{workers:>7} {upload_seconds:>9.2f} {total_mb / upload_seconds:>8.1f} {skip_seconds:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel dataset uploads.")
+    parser.add_argument("--backend", choices=("local", "azure"), default="local")
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+import io
+import json
+import struct
+import numpy as np
+from psycopg2.extras import Json
+
+# Bulk-load rows into talk / talk_answers with binary COPY.
+# Rows are encoded in PostgreSQL's binary COPY format (vectors in pgvector's binary layout, so no
+# float is ever rendered as text), copied into a temporary staging table and merged into the real
+# table with a single set-based INSERT ... SELECT ... ON CONFLICT DO NOTHING per batch.
+
+TALK_COLUMNS = ("question_id", "question_full", "answers", "question_vector", "answers_vector", "metadata")
+TALK_ANSWERS_COLUMNS = ("question_id", "answer_index", "answer", "source", "answer_vector")
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = COPY_SIGNATURE + struct.pack(">ii", 0, 0)  # No flags, no header extension
+COPY_TRAILER = struct.pack(">h", -1)
+
+def encode_text(value):
+    return value.encode("utf-8")
+
+def encode_jsonb(value):
+    # jsonb binary format: a version byte followed by the JSON text
+    if isinstance(value, Json):
+        value = value.adapted
+    return b"\x01" + json.dumps(value).encode("utf-8")
+
+def encode_vector(value):
+    # pgvector binary format: int16 dimensions, int16 unused, then big-endian float4 values
+    vector = np.asarray(value, dtype=">f4")
+    return struct.pack(">hh", vector.shape[0], 0) + vector.tobytes()
+
+def encode_int4(value):
+    return struct.pack(">i", value)
+
+TALK_ENCODERS = (encode_text, encode_text, encode_jsonb, encode_vector, encode_vector, encode_jsonb)
+TALK_ANSWERS_ENCODERS = (encode_text, encode_int4, encode_text, encode_text, encode_vector)
+
+def encode_copy_binary(rows, encoders):
+    """Encode rows as a binary COPY stream."""
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    field_count = struct.pack(">h", len(encoders))
+    for row in rows:
+        buffer.write(field_count)
+        for value, encode in zip(row, encoders):
+            if value is None:
+                buffer.write(struct.pack(">i", -1))
+                continue
+            data = encode(value)
+            buffer.write(struct.pack(">i", len(data)))
+            buffer.write(data)
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def on_conflict_sql(columns, conflict_columns, upsert=False):
+    """ON CONFLICT clause that either keeps existing rows or overwrites them with the new values."""
+    target = ", ".join(conflict_columns)
+    if not upsert:
+        return f"ON CONFLICT ({target}) DO NOTHING"
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in conflict_columns)
+    return f"ON CONFLICT ({target}) DO UPDATE SET {updates}"
+
+def copy_merge(conn, table, columns, encoders, rows, conflict_columns, upsert=False):
+    """COPY rows into a temporary staging table and merge them into table in one statement."""
+    if not rows:
+        return
+    staging = f"{table}_staging"
+    column_list = ", ".join(columns)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging}
+            (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+        """)
+        cur.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT binary)",
+                        encode_copy_binary(rows, encoders))
+        cur.execute(f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM {staging}
+            {on_conflict_sql(columns, conflict_columns, upsert)};
+        """)
+    conn.commit()
+
+def copy_batch(conn, data_batch, upsert=False):
+    """Bulk-load a batch of talk rows (same layout as insert_batch)."""
+    copy_merge(conn, "talk", TALK_COLUMNS, TALK_ENCODERS, data_batch, ("question_id",), upsert)
+
+def copy_answer_batch(conn, data_batch, upsert=False):
+    """Bulk-load a batch of talk_answers rows (same layout as insert_answer_batch)."""
+    copy_merge(conn, "talk_answers", TALK_ANSWERS_COLUMNS, TALK_ANSWERS_ENCODERS, data_batch,
+               ("question_id", "answer_index"), upsert)
@@ -1,4 +1,5 @@
 import os
+import math
 import psycopg2
 from dotenv import load_dotenv
 
@@ -12,30 +13,90 @@ host = os.getenv('PG_SERVER_NAME')
 port = os.getenv('POSTGRES_PORT')
 database = os.getenv('PG_DATABASE')
 
-# The PostgreSQL connection string 
+# The PostgreSQL connection string
 POSTGRESQL_CONNECTION = f"postgresql://{username}:{password}@{host}:{port}/{database}"
 
-# Create a vector index to allow for faster similarity searches.
+# Index settings, overridable from .env (see tune_vector_index.py for picking values)
+VECTOR_INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'ivfflat')               # 'ivfflat' or 'hnsw'
+HNSW_M = int(os.getenv('HNSW_M', '16'))                                         # Links per node in the HNSW graph
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '64'))             # Candidate list size while building
+IVFFLAT_LISTS = int(os.getenv('IVFFLAT_LISTS')) if os.getenv('IVFFLAT_LISTS') else None  # Derived from row count if unset
 
-def create_vector_index():
+VECTOR_COLUMNS = ("question_vector", "answers_vector")
+
+def ivfflat_lists_for(row_count):
+    """Number of ivfflat lists for a table size, following the pgvector guidance of
+    rows / 1000 up to 1M rows and sqrt(rows) beyond that."""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+def index_name(table, column):
+    return f"{table}_{column}_idx"
+
+def vector_index_sql(table, column, method, name=None, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=None):
+    """Build the CREATE INDEX statement for a cosine-distance vector index."""
+    name = name or index_name(table, column)
+    if method == "hnsw":
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    elif method == "ivfflat":
+        options = f"lists = {int(lists)}"
+    else:
+        raise ValueError(f"Unknown vector index method: {method}")
+    return f"""
+        CREATE INDEX IF NOT EXISTS {name}
+        ON {table} USING {method} ({column} vector_cosine_ops)
+        WITH ({options});
+    """
+
+def count_rows(cur, table, column):
+    cur.execute(f"SELECT count(*) FROM {table} WHERE {column} IS NOT NULL")
+    return cur.fetchone()[0]
+
+# Create vector indexes to allow for faster similarity searches.
+
+def create_vector_index(method=VECTOR_INDEX_METHOD, columns=VECTOR_COLUMNS, m=HNSW_M,
+                        ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS, replace=False, table="talk"):
     try:
         # Connect to the database
         with psycopg2.connect(POSTGRESQL_CONNECTION) as conn:
             with conn.cursor() as cur:
-                # Create the index
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS talk_question_vector_idx 
-                    ON talk USING ivfflat (question_vector vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
-                
+                for column in columns:
+                    # Drop the existing index first when switching method or parameters
+                    if replace:
+                        cur.execute(f"DROP INDEX IF EXISTS {index_name(table, column)};")
+
+                    column_lists = lists
+                    if method == "ivfflat" and column_lists is None:
+                        column_lists = ivfflat_lists_for(count_rows(cur, table, column))
+
+                    # Create the index
+                    cur.execute(vector_index_sql(table, column, method, m=m, ef_construction=ef_construction,
+                                                 lists=column_lists))
+                    settings = f"lists={column_lists}" if method == "ivfflat" else f"m={m}, ef_construction={ef_construction}"
+                    print(f"Created {method} index on {table}.{column} ({settings}).")
+
                 # Commit the transaction
                 conn.commit()
-                
+
         print("Vector index created successfully.")
     except Exception as e:
         print(f"An error occurred while creating the index: {e}")
 
+# Drop vector indexes, e.g. before a bulk load so they are built once afterwards instead of
+# being updated row by row during the load.
+
+def drop_vector_indexes(columns=VECTOR_COLUMNS, table="talk"):
+    try:
+        with psycopg2.connect(POSTGRESQL_CONNECTION) as conn:
+            with conn.cursor() as cur:
+                for column in columns:
+                    cur.execute(f"DROP INDEX IF EXISTS {index_name(table, column)};")
+                conn.commit()
+        print(f"Dropped vector indexes on {table}.")
+    except Exception as e:
+        print(f"An error occurred while dropping the indexes: {e}")
+
 # Run the function to create the index
 if __name__ == "__main__":
-    create_vector_index()
\ No newline at end of file
+    create_vector_index()
@@ -1,50 +1,151 @@
 import os
 from dotenv import load_dotenv
 import json
+import base64
+import codecs
+import queue
+import threading
 import psycopg2
+from psycopg2.extensions import register_adapter, AsIs
 from psycopg2.extras import Json, execute_batch
-from azure.storage.blob import BlobServiceClient
-from langchain_openai import OpenAIEmbeddings
+import numpy as np
+from openai import OpenAI
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
+from bulk_loader import copy_batch, copy_answer_batch, on_conflict_sql, TALK_COLUMNS, TALK_ANSWERS_COLUMNS
+from embedding_store import EmbeddingStore
+from embedding_scheduler import EmbeddingScheduler
+from answer_aggregation import answer_weights, split_batch_embeddings, aggregate_answer_embeddings
+from sync_manifest import record_hash
+from storage_backend import create_storage_backend
 
 # Load environment variables
 load_dotenv()
 
-# Azure Blob Storage setup
-azure_connection_string = os.getenv("AZURE_CONNECTION_STRING")
-container_name = os.getenv("ADLS_CONTAINER_NAME")
-blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-container_client = blob_service_client.get_container_client(container_name)
+# Blob storage setup (Azure Blob Storage, or a local directory with STORAGE_BACKEND=local)
+storage = create_storage_backend()
 
 # PostgreSQL connection string
 POSTGRESQL_CONNECTION = f"postgresql://{os.getenv('PG_ADMIN_USERNAME')}:{os.getenv('PG_ADMIN_PASSWORD')}@{os.getenv('PG_SERVER_NAME')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('PG_DATABASE')}"
 
 # OpenAI Embeddings setup
 openai_api_key = os.getenv("OPENAI_API_KEY")
-embedding_model = OpenAIEmbeddings(api_key=openai_api_key, model="text-embedding-ada-002")
+EMBEDDING_MODEL_NAME = "text-embedding-ada-002"
+# Retries are left to the embedding scheduler, which backs off across all workers on throttling
+openai_client = OpenAI(api_key=openai_api_key, max_retries=0)
+
+def embed_documents(texts):
+    """Embed texts, decoding the base64 API response straight into a float32 matrix (no Python float lists)."""
+    response = openai_client.embeddings.create(input=texts, model=EMBEDDING_MODEL_NAME, encoding_format="base64")
+    data = sorted(response.data, key=lambda item: item.index)
+    return np.stack([np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32) for item in data])
+
+# One scheduler shared by all blob workers: token-packed requests, bounded concurrency and rate limits
+embedding_scheduler = EmbeddingScheduler(
+    embed_documents,
+    model=EMBEDDING_MODEL_NAME,
+    max_concurrency=int(os.getenv("EMBED_MAX_CONCURRENCY", "4")),                 # Embedding requests in flight
+    max_batch_tokens=int(os.getenv("EMBED_MAX_BATCH_TOKENS", "50000")),           # Tokens per request
+    max_batch_texts=int(os.getenv("EMBED_MAX_BATCH_TEXTS", "1000")),              # Texts per request
+    tokens_per_minute=int(os.getenv("EMBED_TOKENS_PER_MINUTE", "0")) or None,     # Account TPM limit (0 = unlimited)
+    requests_per_minute=int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "0")) or None, # Account RPM limit (0 = unlimited)
+    max_retries=int(os.getenv("EMBED_MAX_RETRIES", "6"))
+)
+
+# How a question's answer embeddings are combined into answers_vector: "mean" or "trust" (weighted by source trust)
+ANSWER_WEIGHTING = os.getenv("ANSWER_WEIGHTING", "mean")
+
+# Content-addressed embedding store, so unchanged texts are never re-embedded on later runs
+USE_EMBEDDING_STORE = os.getenv("USE_EMBEDDING_STORE", "true").lower() == "true"
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "embedding_store.sqlite3")
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_MODEL_NAME) if USE_EMBEDDING_STORE else None
+
+# Also store each answer's own embedding in talk_answers for answer-level vector search
+STORE_ANSWER_VECTORS = os.getenv("STORE_ANSWER_VECTORS", "false").lower() == "true"
+
+# Load rows with binary COPY into a staging table instead of batched INSERTs
+BULK_LOAD = os.getenv("BULK_LOAD", "false").lower() == "true"
+
+def adapt_vector(vector):
+    """Render a float32 NumPy vector as a pgvector literal for the INSERT path (COPY sends it in binary)."""
+    return AsIs("'[" + ",".join(map(repr, vector.tolist())) + "]'")
+
+register_adapter(np.ndarray, adapt_vector)
 
 def connect_to_db():
     """Establish a connection to the PostgreSQL database."""
     return psycopg2.connect(POSTGRESQL_CONNECTION)
 
 def list_blobs_in_directory(directory_name):
-    """List all blobs in a specified Azure Blob Storage directory."""
-    return [blob.name for blob in container_client.list_blobs(name_starts_with=directory_name) if '.' in blob.name]
+    """List all blobs in a specified blob storage directory."""
+    return list(storage.list_blobs(directory_name))
+
+def list_blob_etags(directory_name):
+    """List the blobs in a directory with their ETags, which change whenever a blob is rewritten."""
+    return storage.list_blobs(directory_name)
 
 def download_blob_to_string(blob_name):
     """Download a blob's content as a string."""
-    blob_client = container_client.get_blob_client(blob_name)
-    return blob_client.download_blob().readall().decode("utf-8")
+    return b"".join(storage.iter_chunks(blob_name)).decode("utf-8")
 
-# Global variable to track API calls
-api_call_count = 0
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Incrementally parse a top-level JSON array from byte chunks, yielding one element at a time.
+    Only the current element (plus one chunk) is held in memory, regardless of the array's size."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer, position, exhausted = "", 0, False
+    state = "start"  # start -> first (value or "]") -> separator ("," or "]") -> value -> separator ...
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+
+        if position < len(buffer):
+            char = buffer[position]
+            if state == "start":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                state, position = "first", position + 1
+                continue
+            if state == "separator" or (state == "first" and char == "]"):
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' at offset {position} of the JSON array buffer")
+                state, position = "value", position + 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # A value is only complete once a delimiter follows it (e.g. "12" may continue as "12.5")
+                if end < len(buffer) and (buffer[end].isspace() or buffer[end] in ",]"):
+                    yield item
+                    state, position = "separator", end
+                    continue
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
 
-def process_questions_batch(questions_data: List[Dict[Any, Any]], batch_size: int = 100):
-    """Process a batch of questions, generate embeddings, and prepare data for insertion."""
-    global api_call_count
+        if exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Need more data: drop the consumed text and append the next chunk
+        buffer, position = buffer[position:], 0
+        try:
+            buffer += utf8.decode(next(chunks))
+        except StopIteration:
+            buffer += utf8.decode(b"", final=True)
+            exhausted = True
+
+def stream_blob_records(blob_name):
+    """Stream the records of a JSON-array blob without downloading it into memory in one piece."""
+    return iter_json_array(storage.iter_chunks(blob_name))
+
+def process_questions_batch(questions_data: List[Dict[Any, Any]], store_answer_vectors: bool = STORE_ANSWER_VECTORS):
+    """Process a batch of questions, generate embeddings, and prepare data for insertion.
+    Returns the rows for talk and, if store_answer_vectors is set, the rows for talk_answers."""
     start_time = time.time()
 
     # Extract all texts (questions and answers) for embedding
@@ -54,41 +155,39 @@ def process_questions_batch(questions_data: List[Dict[Any, Any]], batch_size: in
         for answer_data in question_data['answers']:
             all_texts.append(answer_data['answer'])
 
-    # Process embeddings in batches
-    all_embeddings = []
-    for i in range(0, len(all_texts), batch_size):
-        batch = all_texts[i:i+batch_size]
-        embed_start = time.time()
-        batch_embeddings = embedding_model.embed_documents(batch)
-        embed_end = time.time()
-        print(f"Batch embedding time: {embed_end - embed_start:.2f} seconds")
-        all_embeddings.extend(batch_embeddings)
-        api_call_count += 1
+    # Embed through the shared scheduler (only the texts missing from the embedding store, if enabled)
+    embed_start = time.time()
+    if embedding_store is not None:
+        all_embeddings = embedding_store.embed(all_texts, embedding_scheduler.embed)
+    else:
+        all_embeddings = embedding_scheduler.embed(all_texts)
+    print(f"Batch embedding time: {time.time() - embed_start:.2f} seconds")
+
+    # Prepare results for database insertion. Vectors stay float32 rows of the batch matrix.
+    answer_counts = [len(question_data['answers']) for question_data in questions_data]
+    question_embeddings, answer_embeddings = split_batch_embeddings(all_embeddings, answer_counts)
+    all_sources = [answer_data['source'] for question_data in questions_data for answer_data in question_data['answers']]
+    combined_answer_embeddings = aggregate_answer_embeddings(
+        answer_embeddings, answer_counts, answer_weights(all_sources, ANSWER_WEIGHTING))
 
-    # Prepare results for database insertion
     results = []
-    embedding_index = 0
-    for question_data in questions_data:
+    answer_results = []
+    answer_row = 0
+    for question_data, question_embedding, combined_answer_embedding in zip(
+            questions_data, question_embeddings, combined_answer_embeddings):
         question_id = question_data['question_id']
         topic = question_data['topic']
         question_title = question_data['question_title']
         question_full = question_data['question_full']
         answers = question_data['answers']
 
-        question_embedding = all_embeddings[embedding_index]
-        embedding_index += 1
-
-        answer_embeddings = []
         answer_sources = []
-        for answer_data in answers:
+        for answer_index, answer_data in enumerate(answers):
             answer_source = answer_data['source']
-            answer_embedding = all_embeddings[embedding_index]
-            embedding_index += 1
-            answer_embeddings.append(answer_embedding)
             answer_sources.append(answer_source)
-
-        # Calculate combined answer embedding
-        combined_answer_embedding = [sum(x) / len(x) for x in zip(*answer_embeddings)]
+            if store_answer_vectors:
+                answer_results.append((question_id, answer_index, answer_data['answer'], answer_source, answer_embeddings[answer_row]))
+            answer_row += 1
 
         metadata = {
             "topic": topic,
@@ -100,9 +199,9 @@ def process_questions_batch(questions_data: List[Dict[Any, Any]], batch_size: in
 
     end_time = time.time()
     print(f"Total batch processing time: {end_time - start_time:.2f} seconds")
-    print(f"API calls made: {api_call_count}")
+    print(f"Embedding progress: {embedding_scheduler.progress()}")
 
-    return results
+    return results, answer_results
 
 def process_blob(blob_name):
     """Process a single blob: download, parse JSON, and process questions."""
@@ -110,42 +209,178 @@ def process_blob(blob_name):
     json_data = json.loads(blob_content)
     return process_questions_batch(json_data)
 
-def insert_batch(conn, data_batch):
-    """Insert a batch of processed data into the database."""
+def insert_batch(conn, data_batch, upsert=False):
+    """Insert a batch of processed data into the database (overwriting existing rows if upsert is set)."""
     with conn.cursor() as cur:
-        execute_batch(cur, """
+        execute_batch(cur, f"""
             INSERT INTO talk (question_id, question_full, answers, question_vector, answers_vector, metadata)
             VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (question_id) DO NOTHING;
+            {on_conflict_sql(TALK_COLUMNS, ("question_id",), upsert)};
         """, data_batch)
     conn.commit()
 
-def load_data():
-    """Main function to load data from Azure Blob Storage, process it, and insert into the database."""
-    directories = ["counsel_chat_data/", "mentalhealth_data/"]
-    all_blobs = []
-    for directory in directories:
-        all_blobs.extend(list_blobs_in_directory(directory))
+def insert_answer_batch(conn, data_batch, upsert=False):
+    """Insert a batch of per-answer rows into talk_answers."""
+    with conn.cursor() as cur:
+        execute_batch(cur, f"""
+            INSERT INTO talk_answers (question_id, answer_index, answer, source, answer_vector)
+            VALUES (%s, %s, %s, %s, %s)
+            {on_conflict_sql(TALK_ANSWERS_COLUMNS, ("question_id", "answer_index"), upsert)};
+        """, data_batch)
+    conn.commit()
 
-    processed_data = []
-    # Process blobs concurrently
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_blob = {executor.submit(process_blob, blob_name): blob_name for blob_name in all_blobs}
-        for future in tqdm(as_completed(future_to_blob), total=len(all_blobs), desc="Processing blobs"):
-            blob_name = future_to_blob[future]
+def delete_answers(conn, question_ids):
+    """Remove the stored answers of questions that are about to be rewritten (committed with the new rows),
+    so answers dropped from an edited record do not linger in talk_answers."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM talk_answers WHERE question_id = ANY(%s)", (list(question_ids),))
+
+class PipelineStats:
+    """Thread-safe per-stage counters for the ingestion pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._start = time.time()
+
+    def add(self, stage, items, seconds):
+        with self._lock:
+            count, busy = self._stages.get(stage, (0, 0.0))
+            self._stages[stage] = (count + items, busy + seconds)
+
+    def count(self, stage):
+        with self._lock:
+            return self._stages.get(stage, (0, 0.0))[0]
+
+    def report(self):
+        elapsed = time.time() - self._start
+        print(f"Pipeline finished in {elapsed:.2f} seconds")
+        with self._lock:
+            for stage, (count, busy) in self._stages.items():
+                # Busy time is summed over all threads working on the stage
+                rate = count / busy if busy else 0.0
+                print(f"  {stage:<10} {count:>7} items  {busy:>8.2f}s busy  {rate:>9.1f} items/s busy  "
+                      f"{count / elapsed if elapsed else 0.0:>9.1f} items/s overall")
+
+_END_OF_STREAM = object()
+
+def produce_blob_batches(blob_name, output_queue, stats, records_per_batch, manifest=None):
+    """Read a blob's records incrementally, embed them in batches and hand the rows to the writer.
+    With a manifest, records whose content hash is unchanged since the last sync are skipped."""
+    records = stream_blob_records(blob_name)
+    exhausted = False
+    while not exhausted:
+        read_start = time.time()
+        batch, hashes = [], []
+        exhausted = True
+        for record in records:
+            if manifest is not None:
+                content_hash = record_hash(record)
+                if not manifest.record_changed(record['question_id'], content_hash):
+                    continue
+                hashes.append((record['question_id'], content_hash))
+            batch.append(record)
+            if len(batch) >= records_per_batch:
+                exhausted = False
+                break
+        stats.add("read", len(batch), time.time() - read_start)
+        if not batch:
+            return
+
+        embed_start = time.time()
+        rows, answer_rows = process_questions_batch(batch)
+        stats.add("embed", len(batch), time.time() - embed_start)
+
+        # Blocks when the writer falls behind, which keeps memory bounded
+        output_queue.put((rows, answer_rows, hashes))
+
+def write_batches(input_queue, stats, errors, bulk_load=BULK_LOAD, manifest=None):
+    """Insert row batches from the queue until the end-of-stream marker arrives.
+    With a manifest, existing rows are overwritten and the written records are marked as synced."""
+    write_rows, write_answer_rows = (copy_batch, copy_answer_batch) if bulk_load else (insert_batch, insert_answer_batch)
+    upsert = manifest is not None
+    conn = None
+    try:
+        try:
+            conn = connect_to_db()
+        except Exception as exc:
+            errors.append(exc)
+        while True:
+            item = input_queue.get()
+            if item is _END_OF_STREAM:
+                return
+            if errors:
+                continue  # Keep draining so producers never block on a dead writer
+            rows, answer_rows, hashes = item
+            write_start = time.time()
             try:
-                processed_data.extend(future.result())
+                write_rows(conn, rows, upsert)
+                # Answers reference their question, so they are inserted after the questions
+                if answer_rows:
+                    if upsert:
+                        delete_answers(conn, {row[0] for row in rows})
+                    write_answer_rows(conn, answer_rows, upsert)
+                if manifest is not None:
+                    manifest.mark_records(hashes)
             except Exception as exc:
-                print(f'{blob_name} generated an exception: {exc}')
+                errors.append(exc)
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass  # The connection is broken; the first error is the one reported
+                continue
+            stats.add("write", len(rows), time.time() - write_start)
+    finally:
+        if conn is not None:
+            conn.close()
 
-    # Insert processed data into the database
-    conn = connect_to_db()
+def load_data(records_per_batch: int = 50, queue_size: int = 8, max_workers: int = 5, bulk_load: bool = BULK_LOAD,
+              manifest=None):
+    """Main function to load data from Azure Blob Storage, process it, and insert into the database.
+    Blobs are parsed incrementally and embedded in batches by up to max_workers threads, which hand
+    rows to a single writer through a queue of at most queue_size batches, so peak memory stays flat
+    however large the corpus is.
+    With a SyncManifest (incremental sync), only blobs whose ETag changed are read and only changed
+    records are upserted; the caller saves the manifest once the load has succeeded."""
+    directories = ["counsel_chat_data/", "mentalhealth_data/"]
+    blob_etags = {}
+    for directory in directories:
+        blob_etags.update(list_blob_etags(directory))
+    all_blobs = list(blob_etags)
+    if manifest is not None:
+        all_blobs = [blob_name for blob_name in all_blobs if manifest.blob_changed(blob_name, blob_etags[blob_name])]
+        print(f"Incremental sync: {len(all_blobs)} of {len(blob_etags)} blobs changed")
+
+    stats = PipelineStats()
+    row_queue = queue.Queue(maxsize=queue_size)
+    write_errors = []
+    writer = threading.Thread(target=write_batches, args=(row_queue, stats, write_errors, bulk_load, manifest), daemon=True)
+    writer.start()
+
+    # Process blobs concurrently
     try:
-        batch_size = 100
-        for i in tqdm(range(0, len(processed_data), batch_size), desc="Inserting batches"):
-            batch = processed_data[i:i+batch_size]
-            insert_batch(conn, batch)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_blob = {
+                executor.submit(produce_blob_batches, blob_name, row_queue, stats, records_per_batch, manifest): blob_name
+                for blob_name in all_blobs
+            }
+            for future in tqdm(as_completed(future_to_blob), total=len(all_blobs), desc="Processing blobs"):
+                blob_name = future_to_blob[future]
+                try:
+                    future.result()
+                    if manifest is not None:
+                        manifest.mark_blob(blob_name, blob_etags[blob_name])
+                except Exception as exc:
+                    print(f'{blob_name} generated an exception: {exc}')
     finally:
-        conn.close()
+        row_queue.put(_END_OF_STREAM)
+        writer.join()
+
+    stats.report()
+    embedding_scheduler.report()
+    if embedding_store is not None:
+        embedding_store.report()
+    if write_errors:
+        raise write_errors[0]
 
-    return len(processed_data)
\ No newline at end of file
+    return stats.count("write")
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import openai
+import tiktoken
+
+# Embedding scheduler shared by all loader threads.
+# Texts from every blob worker are packed into requests by token count (up to max_batch_tokens and
+# max_batch_texts per request) and sent with at most max_concurrency requests in flight overall.
+# Optional token buckets keep the request and token rates under the account's OpenAI limits, and
+# throttled or transiently failing requests are retried with exponential backoff (honouring
+# Retry-After); a 429 pauses every sender, not just the one that hit it.
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        amount = min(amount, self.capacity)  # A single oversized request must still get through
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+class EmbeddingScheduler:
+    def __init__(self, embed_documents, model="text-embedding-ada-002", max_concurrency=4, max_batch_tokens=50_000,
+                 max_batch_texts=1000, tokens_per_minute=None, requests_per_minute=None, max_retries=6,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.embed_documents = embed_documents
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_texts = max_batch_texts
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def pack_batches(self, texts):
+        """Group text indexes into requests of at most max_batch_tokens tokens and max_batch_texts texts."""
+        batches, batch, batch_tokens = [], [], 0
+        for index, text in enumerate(texts):
+            tokens = len(self.encoding.encode(text, disallowed_special=()))
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_texts):
+                batches.append((batch, batch_tokens))
+                batch, batch_tokens = [], 0
+            batch.append(index)
+            batch_tokens += tokens
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+
+    def _wait_for_pause(self):
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _backoff(self, attempt, exc):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        response = getattr(exc, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        with self._lock:
+            self.retries += 1
+            if isinstance(exc, openai.RateLimitError):
+                # Throttling applies to the whole account, so every sender backs off
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        time.sleep(delay)
+
+    def _send(self, batch_texts, batch_tokens):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_pause()
+            if self.request_bucket is not None:
+                self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                self.token_bucket.acquire(batch_tokens)
+            try:
+                vectors = self.embed_documents(batch_texts)
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt, exc)
+                continue
+            with self._lock:
+                self.requests += 1
+                self.texts += len(batch_texts)
+                self.tokens += batch_tokens
+            return vectors
+
+    def embed(self, texts):
+        """Embed texts through the shared request pool, returning a float32 matrix in the order of texts."""
+        texts = list(texts)
+        futures = [
+            (indexes, self._executor.submit(self._send, [texts[i] for i in indexes], batch_tokens))
+            for indexes, batch_tokens in self.pack_batches(texts)
+        ]
+        vectors = None
+        for indexes, future in futures:
+            batch_vectors = np.asarray(future.result(), dtype=np.float32)
+            if vectors is None:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+            vectors[indexes] = batch_vectors
+        return vectors if vectors is not None else np.empty((0, 0), dtype=np.float32)
+
+    def progress(self):
+        with self._lock:
+            return f"{self.requests} requests, {self.texts} texts, {self.tokens} tokens embedded"
+
+    def report(self):
+        with self._lock:
+            print(f"Embedding scheduler: {self.requests} requests, {self.texts} texts, {self.tokens} tokens, "
+                  f"{self.retries} retries ({self.throttled} throttled)")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,88 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+# Persistent, content-addressed store of text embeddings.
+# Each embedding is keyed by the SHA-256 of the embedding model name and the exact text, so re-running
+# the loader only sends new or changed texts to the embedding API. Vectors are kept as float32 blobs
+# (the precision pgvector stores anyway) in a local SQLite file shared by all loader threads.
+
+class EmbeddingStore:
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def content_hash(self, text):
+        return hashlib.sha256(f"{self.model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes):
+        """Return {content_hash: vector} for the hashes that are in the store."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay below SQLite's limit on the number of bound parameters
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE content_hash IN ({placeholders})", chunk
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        """Store (content_hash, vector) pairs."""
+        rows = [(content_hash, len(vector), np.asarray(vector, dtype=np.float32).tobytes()) for content_hash, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (content_hash, dim, vector) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def embed(self, texts, embed_documents, batch_size=1000):
+        """Embed texts, calling embed_documents (in chunks of batch_size) only for texts not in the store.
+        Each chunk is stored as soon as it is embedded. Returns a float32 matrix in the order of texts."""
+        hashes = [self.content_hash(text) for text in texts]
+        vectors = self.get_many(hashes)
+
+        # Each distinct missing text is embedded once, even if it repeats within the batch
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in vectors and content_hash not in missing:
+                missing[content_hash] = text
+
+        missing_hashes = list(missing)
+        for i in range(0, len(missing_hashes), batch_size):
+            batch_hashes = missing_hashes[i:i + batch_size]
+            batch_vectors = embed_documents([missing[content_hash] for content_hash in batch_hashes])
+            self.put_many(zip(batch_hashes, batch_vectors))
+            vectors.update(zip(batch_hashes, batch_vectors))
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        if not hashes:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[content_hash] for content_hash in hashes]).astype(np.float32, copy=False)
+
+    def report(self):
+        with self._lock:
+            total = self.hits + self.misses
+            rate = self.hits / total if total else 0.0
+            print(f"Embedding store: {self.hits} hits, {self.misses} embedded ({rate:.1%} reused) [{self.path}]")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,38 +1,59 @@
 import os
-from azure.storage.blob import BlobServiceClient
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from sync_manifest import file_md5
 
-# Function to connect to ADLS Gen2
+# Files are uploaded by a pool of UPLOAD_WORKERS threads, and large files are split into blocks that are
+# uploaded in parallel by the storage backend. A file is skipped when the MD5 stored with its blob
+# (or, in incremental mode, the manifest) shows the content is unchanged.
 
-def create_blob_service_client(connection_string):
-    return BlobServiceClient.from_connection_string(connection_string)
+load_dotenv()
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))  # Files uploaded in parallel
 
 # Function to upload files to the respective directories in Azure
 
-def upload_file_to_adls(file_path, container_name, azure_directory, blob_service_client):
+def upload_file_to_adls(file_path, azure_directory, storage, manifest=None):
     blob_path = f"{azure_directory}/{os.path.basename(file_path)}"  # Preserving file name
-    print(f"Uploading {file_path} to {blob_path}...")
     try:
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-        with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+        md5 = file_md5(file_path)
+        # In incremental mode, files whose content is unchanged since the last sync are skipped without a request
+        if manifest is not None and not manifest.file_changed(blob_path, md5):
+            print(f"Skipping unchanged {file_path}")
+            return "skipped"
+        if storage.remote_md5(blob_path) == md5:
+            print(f"Skipping {file_path}: {blob_path} already has the same content")
+            if manifest is not None:
+                manifest.mark_file(blob_path, md5)
+            return "skipped"
+        print(f"Uploading {file_path} to {blob_path}...")
+        storage.upload_file(file_path, blob_path, md5)
+        if manifest is not None:
+            manifest.mark_file(blob_path, md5)
         print(f"Upload complete for {file_path} to {blob_path}")
+        return "uploaded"
     except Exception as e:
         print(f"Failed to upload {file_path} to {blob_path}: {e}")
+        return "failed"
 
-# Function to iterate over the files and upload to corresponding directories
+# Function to iterate over the files and upload them to corresponding directories in parallel
 
-def upload_files_to_adls(local_directory, container_name, directory_mapping, blob_service_client):
+def upload_files_to_adls(local_directory, directory_mapping, storage, manifest=None, max_workers=UPLOAD_WORKERS):
+    uploads = []
     for local_subdirectory, azure_directory in directory_mapping.items():
         full_local_path = os.path.join(local_directory, local_subdirectory)
         if os.path.isdir(full_local_path):
             for file_name in os.listdir(full_local_path):
                 file_path_on_local = os.path.join(full_local_path, file_name)
                 if os.path.isfile(file_path_on_local):
-                    upload_file_to_adls(file_path_on_local, container_name, azure_directory, blob_service_client)
+                    uploads.append((file_path_on_local, azure_directory))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda upload: upload_file_to_adls(*upload, storage, manifest), uploads))
+    return {outcome: results.count(outcome) for outcome in ("uploaded", "skipped", "failed")}
 
 # Function to run the upload process for a specific directory
 
-def run_upload(local_directory, container_name, local_data_folder, adls_directory, blob_service_client):
+def run_upload(local_directory, local_data_folder, adls_directory, storage, manifest=None):
     directory_mapping = {local_data_folder: adls_directory}
-    upload_files_to_adls(local_directory, container_name, directory_mapping, blob_service_client)
\ No newline at end of file
+    return upload_files_to_adls(local_directory, directory_mapping, storage, manifest)
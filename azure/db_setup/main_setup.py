@@ -1,34 +1,51 @@
 import os
 from dotenv import load_dotenv
-from ingest_to_azure import create_blob_service_client, run_upload  # Import the functions from ingest_to_azure.py
+from ingest_to_azure import run_upload  # Import the upload function from ingest_to_azure.py
+from storage_backend import create_storage_backend  # Azure Blob Storage, or a local directory (STORAGE_BACKEND)
 from setup_db_table import table_creation  # Import the table creation function from setup_db_table.py
-from data_loader import load_data  # Import the load_data function
-from create_vector_index import create_vector_index # Import the create_vector_index function
+from data_loader import load_data, STORE_ANSWER_VECTORS  # Import the load_data function
+from create_vector_index import create_vector_index, drop_vector_indexes # Import the index functions
+from sync_manifest import SyncManifest  # Tracks what was already synced for incremental runs
 
 def main():
     # Load environment variables from .env file
     load_dotenv()
 
     local_directory = os.getenv('DATASET_PATH')  # Main dataset directory
-    connection_string = os.getenv('AZURE_CONNECTION_STRING')
-    container_name = os.getenv('ADLS_CONTAINER_NAME')
 
-    # Create the BlobServiceClient
-    blob_service_client = create_blob_service_client(connection_string)
+    # Incremental sync: only changed files are uploaded, changed blobs read and changed records upserted
+    incremental = os.getenv('INCREMENTAL_SYNC', 'false').lower() == 'true'
+    manifest = SyncManifest(os.getenv('SYNC_MANIFEST_PATH', 'sync_manifest.json')) if incremental else None
+
+    # Create the blob storage client
+    storage = create_storage_backend()
     
     # Upload datasets
-    run_upload(local_directory, container_name, 'counsel_chat_data', 'counsel_chat_data', blob_service_client) # Upload counsel_chat_data 
-    run_upload(local_directory, container_name, 'mentalhealth_data', 'mentalhealth_data', blob_service_client) # Upload mentalhealth_data
+    run_upload(local_directory, 'counsel_chat_data', 'counsel_chat_data', storage, manifest) # Upload counsel_chat_data 
+    run_upload(local_directory, 'mentalhealth_data', 'mentalhealth_data', storage, manifest) # Upload mentalhealth_data
 
     # Call the table creation function to create the database table
     table_creation()
 
+    # Drop existing vector indexes so they are rebuilt once after the load (DEFER_INDEX_CREATION)
+    # (not worth it for an incremental sync, which usually touches a handful of rows)
+    if os.getenv('DEFER_INDEX_CREATION', 'false').lower() == 'true' and not incremental:
+        drop_vector_indexes()
+        if STORE_ANSWER_VECTORS:
+            drop_vector_indexes(columns=("answer_vector",), table="talk_answers")
+
     # Load data into the database
-    items_processed = load_data()
+    items_processed = load_data(manifest=manifest)
     print(f"Processed and inserted {items_processed} items into the database.")
 
+    # Remember what was synced, only once the load has succeeded
+    if manifest is not None:
+        manifest.save()
+
     # Create the vector index
     create_vector_index()
+    if STORE_ANSWER_VECTORS:
+        create_vector_index(columns=("answer_vector",), table="talk_answers")  # Index for answer-level search
 
 # Python entry point
 if __name__ == "__main__":
@@ -48,6 +48,24 @@ def table_creation():
             answers_vector VECTOR(1536),  -- Will be using text-embedding-ada-002 (OpenAI) which produces 1536-dimension vectors
             metadata JSONB  -- This will contain topic, question_title, and source
         );
+
+        -- One row per answer with its own embedding, for answer-level vector search (STORE_ANSWER_VECTORS)
+        CREATE TABLE IF NOT EXISTS talk_answers (
+            question_id VARCHAR(50) REFERENCES talk (question_id) ON DELETE CASCADE,
+            answer_index INTEGER,  -- Position of the answer in talk.answers
+            answer TEXT,
+            source TEXT,
+            answer_vector VECTOR(1536),
+            PRIMARY KEY (question_id, answer_index)
+        );
+
+        -- Full-text search vector of each question (weight A) and its answers (weight B) with a GIN index,
+        -- for hybrid and lexical retrieval (RETRIEVER_MODE). Generated, so the loaders need no changes.
+        ALTER TABLE talk ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(question_full, '')), 'A') ||
+            setweight(jsonb_to_tsvector('english', jsonb_path_query_array(coalesce(answers, '[]'), '$[*].answer'), '["string"]'), 'B')
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS talk_search_vector_idx ON talk USING GIN (search_vector);
     """
 
     try:
@@ -0,0 +1,98 @@
+import os
+import shutil
+import uuid
+from dotenv import load_dotenv
+from sync_manifest import file_md5
+
+# Storage backends for the ingest path (uploading the datasets and reading them back in the loader).
+# AzureBlobStorage talks to Azure Blob Storage / ADLS (or the Azurite emulator, given its connection
+# string) and uploads large files as parallel blocks. LocalBlobStorage keeps "blobs" as files under a
+# local directory, so the whole ingest path can run and be benchmarked without any cloud service.
+# Both expose the same small interface: list_blobs, remote_md5, upload_file and iter_chunks.
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "azure")                      # 'azure' or 'local'
+LOCAL_BLOB_ROOT = os.getenv("LOCAL_BLOB_ROOT", "local_blob_storage")         # Root directory of the local backend
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE_MB", "4")) * 1024 * 1024            # Block size of chunked uploads
+UPLOAD_SINGLE_PUT_SIZE = int(os.getenv("UPLOAD_SINGLE_PUT_SIZE_MB", "8")) * 1024 * 1024  # Larger files are uploaded in blocks
+UPLOAD_BLOCK_CONCURRENCY = int(os.getenv("UPLOAD_BLOCK_CONCURRENCY", "4"))               # Blocks in flight per file
+
+class AzureBlobStorage:
+    def __init__(self, connection_string, container_name, block_size=UPLOAD_BLOCK_SIZE,
+                 single_put_size=UPLOAD_SINGLE_PUT_SIZE, block_concurrency=UPLOAD_BLOCK_CONCURRENCY):
+        from azure.storage.blob import BlobServiceClient
+        blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string, max_block_size=block_size, max_single_put_size=single_put_size)
+        self.container_client = blob_service_client.get_container_client(container_name)
+        self.block_concurrency = block_concurrency
+
+    def list_blobs(self, prefix):
+        """Return {blob name: ETag} for the files under prefix."""
+        return {blob.name: blob.etag for blob in self.container_client.list_blobs(name_starts_with=prefix) if '.' in blob.name}
+
+    def remote_md5(self, blob_name):
+        """MD5 (hex) stored with the blob, or None if the blob does not exist or has no MD5."""
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            properties = self.container_client.get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        content_md5 = properties.content_settings.content_md5
+        return bytes(content_md5).hex() if content_md5 else None
+
+    def upload_file(self, file_path, blob_name, md5):
+        from azure.storage.blob import ContentSettings
+        # Block uploads do not get a whole-blob MD5 from the service, so it is set explicitly
+        content_settings = ContentSettings(content_md5=bytearray.fromhex(md5))
+        with open(file_path, "rb") as data:
+            self.container_client.get_blob_client(blob_name).upload_blob(
+                data, overwrite=True, max_concurrency=self.block_concurrency, content_settings=content_settings)
+
+    def iter_chunks(self, blob_name):
+        return self.container_client.get_blob_client(blob_name).download_blob().chunks()
+
+class LocalBlobStorage:
+    def __init__(self, root=LOCAL_BLOB_ROOT, block_size=UPLOAD_BLOCK_SIZE):
+        self.root = root
+        self.block_size = block_size
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, blob_name):
+        return os.path.join(self.root, *blob_name.split("/"))
+
+    def list_blobs(self, prefix):
+        blobs = {}
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                blob_name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if blob_name.startswith(prefix) and '.' in blob_name and not file_name.startswith(".upload-"):
+                    stat = os.stat(path)
+                    blobs[blob_name] = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'  # Changes whenever the file is rewritten
+        return blobs
+
+    def remote_md5(self, blob_name):
+        path = self._path(blob_name)
+        return file_md5(path) if os.path.exists(path) else None
+
+    def upload_file(self, file_path, blob_name, md5):
+        path = self._path(blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy in blocks to a temporary file and swap it in, so readers never see a partial blob
+        temp_path = os.path.join(os.path.dirname(path), f".upload-{uuid.uuid4().hex}")
+        with open(file_path, "rb") as source, open(temp_path, "wb") as target:
+            shutil.copyfileobj(source, target, self.block_size)
+        os.replace(temp_path, path)
+
+    def iter_chunks(self, blob_name, chunk_size=4 * 1024 * 1024):
+        with open(self._path(blob_name), "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+
+def create_storage_backend(backend=STORAGE_BACKEND):
+    """Create the storage backend selected by STORAGE_BACKEND."""
+    if backend == "local":
+        return LocalBlobStorage()
+    if backend == "azure":
+        return AzureBlobStorage(os.getenv("AZURE_CONNECTION_STRING"), os.getenv("ADLS_CONTAINER_NAME"))
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import threading
+
+# Manifest of what has already been synced, used by the incremental mode of main_setup.py.
+# It records the MD5 of every uploaded local file, the ETag of every fully processed blob and a
+# content hash of every record written to Postgres, so a later run only uploads changed files,
+# only reads changed blobs and only re-embeds and upserts the records that actually changed.
+# The manifest is a JSON file that is rewritten atomically, and only after a successful run.
+
+def file_md5(path, chunk_size=4 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def record_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class SyncManifest:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.files, self.blobs, self.records = {}, {}, {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.blobs = data.get("blobs", {})
+            self.records = data.get("records", {})
+
+    def file_changed(self, path, md5):
+        with self._lock:
+            return self.files.get(path) != md5
+
+    def mark_file(self, path, md5):
+        with self._lock:
+            self.files[path] = md5
+
+    def blob_changed(self, blob_name, etag):
+        with self._lock:
+            return self.blobs.get(blob_name) != etag
+
+    def mark_blob(self, blob_name, etag):
+        with self._lock:
+            self.blobs[blob_name] = etag
+
+    def record_changed(self, question_id, content_hash):
+        with self._lock:
+            return self.records.get(str(question_id)) != content_hash
+
+    def mark_records(self, hashes):
+        """Record (question_id, content_hash) pairs once their rows are written."""
+        with self._lock:
+            for question_id, content_hash in hashes:
+                self.records[str(question_id)] = content_hash
+
+    def save(self):
+        with self._lock:
+            data = {"files": self.files, "blobs": self.blobs, "records": self.records}
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
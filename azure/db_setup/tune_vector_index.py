@@ -0,0 +1,119 @@
+import argparse
+import statistics
+import time
+import psycopg2
+from create_vector_index import POSTGRESQL_CONNECTION, ivfflat_lists_for, count_rows, vector_index_sql
+
+# Sweep vector index parameters and measure recall@k against exact search along with query latency.
+# Each candidate index is built inside a transaction that is rolled back afterwards, so the sweep
+# leaves the schema unchanged. Existing indexes on the column are dropped inside the same transaction
+# while the candidate is measured, which locks the table until it is rolled back: run this against a
+# development copy of the database, not the live one.
+#
+# Usage:
+#   python tune_vector_index.py --column question_vector --k 10 --queries 50 --target-recall 0.95
+
+HNSW_GRID = {"m": [8, 16, 32], "ef_construction": [32, 64, 128], "ef_search": [10, 20, 40, 80, 160]}
+IVFFLAT_PROBES = [1, 2, 5, 10, 20, 50]
+
+def sample_queries(cur, table, column, n):
+    """Use stored vectors as query vectors."""
+    cur.execute(f"SELECT {column}::text FROM {table} WHERE {column} IS NOT NULL ORDER BY random() LIMIT %s", (n,))
+    return [row[0] for row in cur.fetchall()]
+
+def top_k(cur, table, column, query, k):
+    cur.execute(f"SELECT question_id FROM {table} ORDER BY {column} <=> %s::vector LIMIT %s", (query, k))
+    return [row[0] for row in cur.fetchall()]
+
+def exact_results(cur, table, column, queries, k):
+    """Ground truth from a sequential scan with the vector indexes disabled."""
+    cur.execute("SET LOCAL enable_indexscan = off")
+    cur.execute("SET LOCAL enable_bitmapscan = off")
+    results = [set(top_k(cur, table, column, query, k)) for query in queries]
+    cur.execute("RESET enable_indexscan")
+    cur.execute("RESET enable_bitmapscan")
+    return results
+
+def measure(cur, table, column, queries, truth, k):
+    """Return mean recall@k and median / p95 latency (ms) of index-backed searches."""
+    # Force the index so small tables do not fall back to a sequential scan
+    cur.execute("SET LOCAL enable_seqscan = off")
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = top_k(cur, table, column, query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected.intersection(found)) / max(len(expected), 1))
+    latencies.sort()
+    return statistics.mean(recalls), statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+def drop_column_indexes(cur, table, column):
+    """Drop existing vector indexes on the column (inside the sweep's transaction)."""
+    cur.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = %s AND indexdef ILIKE %s AND indexdef ~* '(hnsw|ivfflat)'
+    """, (table, f"%({column} %"))
+    for (name,) in cur.fetchall():
+        cur.execute(f"DROP INDEX {name}")
+
+def candidates(method, row_count):
+    if method in ("hnsw", "both"):
+        for m in HNSW_GRID["m"]:
+            for ef_construction in HNSW_GRID["ef_construction"]:
+                build = {"method": "hnsw", "m": m, "ef_construction": ef_construction}
+                yield build, [("hnsw.ef_search", ef) for ef in HNSW_GRID["ef_search"]]
+    if method in ("ivfflat", "both"):
+        base = ivfflat_lists_for(row_count)
+        for lists in sorted({max(1, base // 2), base, base * 2, base * 4}):
+            build = {"method": "ivfflat", "lists": lists}
+            yield build, [("ivfflat.probes", probes) for probes in IVFFLAT_PROBES if probes <= lists]
+
+def sweep(table, column, method, k, n_queries, target_recall):
+    results = []
+    with psycopg2.connect(POSTGRESQL_CONNECTION) as conn:
+        with conn.cursor() as cur:
+            row_count = count_rows(cur, table, column)
+            queries = sample_queries(cur, table, column, n_queries)
+            truth = exact_results(cur, table, column, queries, k)
+        conn.rollback()
+        print(f"{row_count} rows, {len(queries)} queries, k={k}")
+        print(f"{'index':<34} {'search':<22} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+
+        for build, search_settings in candidates(method, row_count):
+            with conn.cursor() as cur:
+                drop_column_indexes(cur, table, column)
+                start = time.perf_counter()
+                cur.execute(vector_index_sql(table, column, build["method"], name=f"{table}_{column}_tune_idx",
+                                             m=build.get("m"), ef_construction=build.get("ef_construction"),
+                                             lists=build.get("lists")))
+                build_seconds = time.perf_counter() - start
+                label = ", ".join(f"{key}={value}" for key, value in build.items())
+
+                for setting, value in search_settings:
+                    cur.execute("SELECT set_config(%s, %s, true)", (setting, str(value)))
+                    recall, p50, p95 = measure(cur, table, column, queries, truth, k)
+                    results.append({"index": label, "search": f"{setting}={value}", "recall": recall,
+                                    "p50": p50, "p95": p95, "build": build_seconds})
+                    print(f"{label:<34} {setting + '=' + str(value):<22} {recall:>7.3f} {p50:>8.2f} {p95:>8.2f} {build_seconds:>8.2f}")
+            # Discard the candidate index and restore the dropped ones
+            conn.rollback()
+
+    meeting_target = [r for r in results if r["recall"] >= target_recall]
+    if meeting_target:
+        best = min(meeting_target, key=lambda r: r["p50"])
+        print(f"\nFastest setting with recall@{k} >= {target_recall}: {best['index']}, {best['search']} "
+              f"(recall {best['recall']:.3f}, p50 {best['p50']:.2f} ms)")
+    else:
+        print(f"\nNo setting reached recall@{k} >= {target_recall}.")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall@k and latency of vector index parameters.")
+    parser.add_argument("--table", default="talk")
+    parser.add_argument("--column", default="question_vector", choices=["question_vector", "answers_vector"])
+    parser.add_argument("--method", default="both", choices=["hnsw", "ivfflat", "both"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    args = parser.parse_args()
+    sweep(args.table, args.column, args.method, args.k, args.queries, args.target_recall)